@@ -1,27 +1,138 @@
 import os
+import queue
 import sqlite3
 import threading
+from contextlib import contextmanager
 
 import bcrypt
 
+import document_journal
 from file import File
+from permission_cache import PermissionCache
 from user import User
 from user_access import UserAccess
 
+READER_CONNECTIONS = 4
+BUSY_TIMEOUT = 5.0  # seconds a statement waits for a lock held by another connection
+CACHE_SIZE_KB = 16 * 1024
+MMAP_SIZE = 256 * 1024 * 1024
+MAX_QUERY_PARAMS = 500  # bound parameters per IN (...) query, below SQLite's variable limit
+STATEMENT_CACHE_SIZE = 256  # prepared statements kept per connection and reused across calls
+
+# Schema changes applied on top of the tables in create_tables. Migration n brings a database from
+# PRAGMA user_version n to n + 1, so existing users.db files are upgraded in place at startup.
+# Only append to this list; never edit a migration that has shipped.
+MIGRATIONS = [
+    [
+        # Files owned by a user (delete_file, the owner join of get_readable_files_per_user)
+        "CREATE INDEX IF NOT EXISTS idx_files_owner ON files(owner_id)",
+        # Covering index for the readable file list: the file ids come straight from the index
+        "CREATE INDEX IF NOT EXISTS idx_file_access_user_read ON file_access(user_id, can_read, file_id)",
+        # Access list of a file and the ON DELETE CASCADE from files, which runs because connect
+        # enables foreign keys; UNIQUE(user_id, file_id) leads with user_id
+        "CREATE INDEX IF NOT EXISTS idx_file_access_file ON file_access(file_id)",
+        "ANALYZE",
+    ],
+    [
+        # Access rows of files deleted while foreign keys were off; they still granted access to the file id
+        "DELETE FROM file_access WHERE file_id NOT IN (SELECT id FROM files)",
+    ],
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
 
 class Database:
-    def __init__(self, db_name="users.db"):
+    def __init__(self, db_name="users.db", readers=READER_CONNECTIONS):
         """
         Initialize the UserDatabase with a SQLite connection and create tables if they do not exist.
 
+        The database runs in WAL mode: a single writer connection, guarded by self.lock, performs all
+        writes while a pool of read-only connections serves queries concurrently with it. File
+        content on disk is guarded by one lock per file (see file_lock), so journal fsyncs never
+        hold up SQL, and a slow write to one document never delays the others.
+
         :param db_name: Name of the SQLite database file
         :type db_name: str
+        :param readers: Number of pooled read connections
+        :type readers: int
         """
-        self.conn = sqlite3.connect(db_name, check_same_thread=False)
+        self.conn = self.connect(db_name)
+        self.conn.execute("PRAGMA journal_mode=WAL")
         self.cursor = self.conn.cursor()
         self.lock = threading.Lock()
+        self.file_locks = {}  # file id -> lock guarding the file's snapshot and journal
+        self.file_locks_lock = threading.Lock()
+        self.permissions = PermissionCache()
         self.create_tables()
 
+        self.readers = queue.Queue()
+        for _ in range(readers):
+            reader = self.connect(db_name)
+            reader.execute("PRAGMA query_only=ON")
+            self.readers.put(reader)
+
+    @staticmethod
+    def connect(db_name):
+        """
+        Open a connection with the pragmas every connection of the pool uses.
+
+        :param db_name: Name of the SQLite database file
+        :type db_name: str
+
+        :return: The connection
+        :rtype: sqlite3.Connection
+        """
+        conn = sqlite3.connect(db_name, check_same_thread=False, timeout=BUSY_TIMEOUT,
+                               cached_statements=STATEMENT_CACHE_SIZE)
+        conn.execute("PRAGMA synchronous=NORMAL")  # safe in WAL mode, fsyncs only at checkpoints
+        conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KB}")
+        conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA foreign_keys=ON")  # off by default; deleting a file cascades to its access rows
+        return conn
+
+    @contextmanager
+    def reader(self):
+        """
+        Borrow a read connection from the pool for the duration of a with block.
+
+        :return: A cursor of the borrowed connection
+        :rtype: sqlite3.Cursor
+        """
+        conn = self.readers.get()
+        try:
+            yield conn.cursor()
+        finally:
+            self.readers.put(conn)
+
+    def file_lock(self, file_id: str) -> threading.Lock:
+        """
+        Return the lock that guards a file's snapshot and journal on disk.
+
+        :param file_id: The id of the file
+        :type file_id: str
+
+        :return: The lock of the file
+        :rtype: threading.Lock
+        """
+        with self.file_locks_lock:
+            return self.file_locks.setdefault(file_id, threading.Lock())
+
+    def get_file_path(self, file_id: str):
+        """
+        Return the path of a file's snapshot.
+
+        :param file_id: The id of the file
+        :type file_id: str
+
+        :return: The path, or None if there is no such file
+        :rtype: str or None
+        """
+        with self.reader() as cursor:
+            cursor.execute("SELECT path FROM files WHERE id = ?", (file_id,))
+            result = cursor.fetchone()
+        return result[0] if result else None
+
     def create_tables(self):
         """
         Create the required database tables for users, files, and file access permissions.
@@ -59,6 +170,27 @@ class Database:
                 )
             """)
             self.conn.commit()
+            self.migrate()
+
+    def migrate(self):
+        """
+        Apply the migrations a database has not seen yet, each in its own transaction.
+        Called with the writer lock held.
+
+        :return: None
+        """
+        version = self.cursor.execute("PRAGMA user_version").fetchone()[0]
+        for number, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+            try:
+                self.cursor.execute("BEGIN")  # DDL does not open a transaction implicitly
+                for statement in statements:
+                    self.cursor.execute(statement)
+                # PRAGMA does not take parameters; number comes from this module
+                self.cursor.execute(f"PRAGMA user_version={number}")
+                self.conn.commit()
+            except sqlite3.Error:
+                self.conn.rollback()
+                raise
 
     def add_user(self, user: User):
         """
@@ -81,9 +213,25 @@ class Database:
             except sqlite3.IntegrityError:
                 return False
 
+    def get_login(self, username: str):
+        """
+        Fetch what a login needs to be verified, without checking the password.
+
+        :param username: The username that is logging in
+        :type username: str
+
+        :return: Tuple of (user_id, stored password hash), or (None, None) if there is no such user
+        :rtype: tuple[int or None, bytes or None]
+        """
+        with self.reader() as cursor:
+            cursor.execute("SELECT id, password FROM users WHERE username=?", (username,))
+            row = cursor.fetchone()
+        return (row[0], row[1]) if row else (None, None)
+
     def verify_user(self, user: User):
         """
-        Verify user credentials during login.
+        Verify user credentials during login on the calling thread.
+        The server checks passwords on its AuthPool instead, using get_login.
 
         :param user: The User object containing username and password
         :type user: User
@@ -91,19 +239,13 @@ class Database:
         :return: Tuple of (login_successful, user_id)
         :rtype: tuple[bool, int or None]
         """
-        user_id = self.get_user_id(user.username)
-        with self.lock:
-            self.cursor.execute("SELECT password FROM users WHERE id=?", (user_id,))
-            row = self.cursor.fetchone()
-
-            if row is None:
-                return False, None
-
-            stored_hashed_password = row[0]
+        user_id, stored_hashed_password = self.get_login(user.username)
+        if user_id is None:
+            return False, None
 
-            password_matches = bcrypt.checkpw(user.password.encode('utf-8'), stored_hashed_password)
+        password_matches = bcrypt.checkpw(user.password.encode('utf-8'), stored_hashed_password)
 
-            return password_matches, user_id if password_matches else None
+        return password_matches, user_id if password_matches else None
 
     def add_file(self, user: User, file: File, content: str):
         """
@@ -121,6 +263,8 @@ class Database:
         """
         if not user.user_id:
             return False
+        if not self.is_plain_name(user.username) or not self.is_plain_name(file.filename):
+            return False
 
         base_dir = os.path.join("CoEdit_users", user.username)
         os.makedirs(base_dir, exist_ok=True)  # create a directory if doesnt exist
@@ -128,8 +272,7 @@ class Database:
         full_path = os.path.join(base_dir, file.filename)
 
         try:
-            with open(full_path, "w", encoding="utf-8") as f:
-                f.write(content)
+            document_journal.atomic_write(full_path, content.encode('utf-8'))
 
             with self.lock:
                 self.cursor.execute(
@@ -143,6 +286,33 @@ class Database:
         except Exception as e:
             return False, f"Error saving file: {str(e)}"
 
+    @staticmethod
+    def is_plain_name(name) -> bool:
+        """
+        Check that a user chosen name can be used as one path component inside CoEdit_users,
+        so documents never land outside their owner's directory.
+
+        :param name: A filename or username
+        :type name: str
+
+        :return: True if the name is safe to use on disk
+        :rtype: bool
+        """
+        if not isinstance(name, str) or name in ('', '.', '..') or '\0' in name:
+            return False
+        return '/' not in name and '\\' not in name
+
+    def get_file_paths(self) -> list[tuple[str, str]]:
+        """
+        Return the id and snapshot path of every file, used by the recovery pass at startup.
+
+        :return: List of (file id, path)
+        :rtype: list[tuple[str, str]]
+        """
+        with self.reader() as cursor:
+            cursor.execute("SELECT id, path FROM files")
+            return cursor.fetchall()
+
     def get_file_content(self, user: User, file: File):
         """
         Retrieve file content from disk if the user has read access.
@@ -159,20 +329,17 @@ class Database:
             print("User does not have read access")
             return None
 
-        with self.lock:
-            self.cursor.execute("SELECT path FROM files WHERE id = ?", (file.file_id,))
-            result = self.cursor.fetchone()
-
-        if result:
-            path = result[0]
+        with self.file_lock(file.file_id):
+            path = self.get_file_path(file.file_id)
+            if path is None:
+                return None
             try:
-                with open(path, "r", encoding="utf-8") as f:
-                    file_content = f.read()
-                    print(f'get_file_content, path: {path}, file_content: {file_content}')
-                    return file_content or ''
+                # The latest content is the snapshot plus the operations journaled since
+                file_content = document_journal.read_document(path, file.file_id)
             except FileNotFoundError:
                 return None
-        return ''
+        print(f'get_file_content, path: {path}, length: {len(file_content)}')
+        return file_content
 
     def update_file_content(self, user: User, file: File, content: str) -> bool:
         """
@@ -192,23 +359,73 @@ class Database:
             print(f"User {user.username} does not have write access")
             return False
 
-        with self.lock:
-            self.cursor.execute("SELECT path FROM files WHERE id = ?", (file.file_id,))
-            result = self.cursor.fetchone()
-            print("Stored file path:", result[0])
-            if result:
-                print(result[0])
-                path = result[0]
+        with self.file_lock(file.file_id):
+            path = self.get_file_path(file.file_id)
+            print("Stored file path:", path)
+            if path:
                 try:
-                    with open(path, "w", encoding="utf-8") as f:
-                        print(f'updated to file, path: {path}, content: {content}')
-                        f.write(content)
+                    document_journal.write_snapshot(path, file.file_id, content)
+                    print(f'updated to file, path: {path}, length: {len(content)}')
                     return True
                 except Exception as e:
                     print("Error writing file:", e)
                     return False
         return False
 
+    def save_file_content(self, file_id: str, content: str) -> bool:
+        """
+        Write a new snapshot of a file without an access check, for edits that were already
+        validated when they were accepted. The snapshot replaces the file's journal.
+
+        :param file_id: The id of the file
+        :type file_id: str
+        :param content: The new content to be saved
+        :type content: str
+
+        :return: True if the content was written, False otherwise
+        :rtype: bool
+        """
+        with self.file_lock(file_id):
+            path = self.get_file_path(file_id)
+            if not path:
+                return False
+
+            try:
+                document_journal.write_snapshot(path, file_id, content)
+                return True
+            except Exception as e:
+                print("Error writing file:", e)
+                return False
+
+    def append_file_changes(self, file_id: str, changes, sync=True):
+        """
+        Append already validated operations to a file's journal instead of rewriting the file.
+
+        :param file_id: The id of the file
+        :type file_id: str
+        :param changes: The operations applied since the last append
+        :type changes: list[Operation]
+        :param sync: Whether to fsync the journal before returning
+        :type sync: bool
+
+        :return: The size of the journal in bytes, or None if the append failed
+        :rtype: int or None
+        :raises FileNotFoundError: If the file was deleted, so the operations can never be written
+        """
+        with self.file_lock(file_id):
+            path = self.get_file_path(file_id)
+            if not path:
+                raise FileNotFoundError(f"File {file_id} no longer exists")
+
+            try:
+                return document_journal.append(path, file_id, changes, sync)
+            except FileNotFoundError:
+                # The snapshot is gone, which only a delete does
+                raise
+            except Exception as e:
+                print("Error appending to journal:", e)
+                return None
+
     def delete_file(self, file: File, user: User):
         """
         Deletes a file from both the database and disk.
@@ -222,7 +439,7 @@ class Database:
         :return: Tuple of success status and a message
         :rtype: tuple[bool, str]
         """
-        with self.lock:
+        with self.file_lock(file.file_id), self.lock:
             self.cursor.execute("SELECT path FROM files WHERE id=? AND owner_id=?", (file.file_id, user.user_id))
             result = self.cursor.fetchone()
 
@@ -231,11 +448,15 @@ class Database:
                 if os.path.exists(path):
                     try:
                         os.remove(path)
+                        document_journal.remove(file.file_id)
                     except Exception as e:
                         print(f"Warning: Failed to delete file from disk: {e}")
 
                 self.cursor.execute("DELETE FROM files WHERE id=? AND owner_id=?", (file.file_id, user.user_id))
                 self.conn.commit()
+                self.permissions.invalidate_file(file.file_id)
+                with self.file_locks_lock:
+                    self.file_locks.pop(file.file_id, None)
                 return True
         return False
 
@@ -249,9 +470,9 @@ class Database:
         :return: User ID or None if not found
         :rtype: int or None
         """
-        with self.lock:
-            self.cursor.execute("SELECT id FROM users WHERE username=?", (username,))
-            result = self.cursor.fetchone()
+        with self.reader() as cursor:
+            cursor.execute("SELECT id FROM users WHERE username=?", (username,))
+            result = cursor.fetchone()
             return result[0] if result else None
 
     def check_if_user_exists_by_username(self, username: str):
@@ -264,18 +485,45 @@ class Database:
         :return: User object if found, else None
         :rtype: User or None
         """
-        self.cursor.execute("""
-            SELECT id, first_name, last_name, username, password
-            FROM users
-            WHERE username = ?
-        """, (username,))
-        row = self.cursor.fetchone()
+        with self.reader() as cursor:
+            cursor.execute("""
+                SELECT id, first_name, last_name, username, password
+                FROM users
+                WHERE username = ?
+            """, (username,))
+            row = cursor.fetchone()
         if row:
             user_id, first_name, last_name, username, password = row
             return User(user_id, first_name, last_name, username, password)
         else:
             return None
 
+    def get_permissions(self, user: User, file: File):
+        """
+        Get the read and write access of a user to a file, served from the permission cache when possible.
+
+        :param user: The User object
+        :type user: User
+        :param file: The File object
+        :type file: File
+
+        :return: Tuple of (can_read, can_write)
+        :rtype: tuple[bool, bool]
+        """
+        permissions, version = self.permissions.get(user.user_id, file.file_id)
+        if permissions is not None:
+            return permissions
+
+        with self.reader() as cursor:
+            cursor.execute(
+                "SELECT can_read, can_write FROM file_access WHERE user_id=? AND file_id=?",
+                (user.user_id, file.file_id)
+            )
+            result = cursor.fetchone()
+        permissions = (bool(result[0]), bool(result[1])) if result else (False, False)
+        self.permissions.put(user.user_id, file.file_id, permissions, version)
+        return permissions
+
     def can_user_read(self, user: User, file: File) -> bool:
         """
         Check if the user has read access to a specific file.
@@ -288,12 +536,7 @@ class Database:
         :return: True if user can read the file, False otherwise
         :rtype: bool
         """
-        with self.lock:
-            self.cursor.execute(
-                "SELECT can_read FROM file_access WHERE user_id=? AND file_id=?", (user.user_id, file.file_id)
-            )
-            result = self.cursor.fetchone()
-            return result[0] if result else False
+        return self.get_permissions(user, file)[0]
 
     def check_write(self, user: User, file: File):
         """
@@ -307,17 +550,7 @@ class Database:
         :return: True if the user has write access, False otherwise
         :rtype: bool
         """
-        with self.lock:
-            # Check if the user has write access
-            self.cursor.execute("""
-                SELECT can_write FROM file_access
-                JOIN users ON file_access.user_id = users.id
-                WHERE users.id = ? AND file_access.file_id = ?
-            """, (user.user_id, file.file_id))
-            access_result = self.cursor.fetchone()
-            if not access_result or not access_result[0]:
-                return False  # User has no write access
-            return True
+        return self.get_permissions(user, file)[1]
 
     def get_readable_files_per_user(self, user: User) -> list[File]:
         """
@@ -329,8 +562,8 @@ class Database:
         :return: List of File objects the user can read
         :rtype: list[File]
         """
-        with self.lock:
-            self.cursor.execute("""
+        with self.reader() as cursor:
+            cursor.execute("""
                 SELECT f.id, f.filename, f.path, f.creation_date,
                        u.id, u.first_name, u.last_name, u.username, u.password
                 FROM files f
@@ -339,7 +572,7 @@ class Database:
                 WHERE fa.user_id = ? AND fa.can_read = 1
             """, (user.user_id,))
 
-            rows = self.cursor.fetchall()
+            rows = cursor.fetchall()
             readable_files = []
             for row in rows:
                 file_id, filename, path, creation_date = row[:4]
@@ -389,6 +622,7 @@ class Database:
             """, (user_id, file_id, int(can_read), int(can_write)))
 
             self.conn.commit()
+            self.permissions.invalidate(user_id, file_id)
             return True
 
     def change_file_access(self, user: User, file: File, can_read: bool, can_write: bool):
@@ -431,8 +665,63 @@ class Database:
                 """, (user_id, file_id, int(can_read), int(can_write)))
 
             self.conn.commit()
+            self.permissions.invalidate(user_id, file_id)
             return True
 
+    def get_user_ids(self, usernames) -> dict:
+        """
+        Resolve many usernames to user ids with one query per MAX_QUERY_PARAMS names.
+
+        :param usernames: The usernames to look up
+        :type usernames: Iterable[str]
+
+        :return: Dictionary of username to user id; unknown usernames are left out
+        :rtype: dict[str, int]
+        """
+        usernames = list(dict.fromkeys(usernames))
+        user_ids = {}
+        with self.reader() as cursor:
+            for start in range(0, len(usernames), MAX_QUERY_PARAMS):
+                chunk = usernames[start:start + MAX_QUERY_PARAMS]
+                placeholders = ', '.join('?' * len(chunk))
+                cursor.execute(f"SELECT username, id FROM users WHERE username IN ({placeholders})", chunk)
+                user_ids.update(cursor.fetchall())
+        return user_ids
+
+    def update_file_access(self, file: File, updated_access) -> int:
+        """
+        Apply a whole access table diff to a file in a single transaction.
+
+        :param file: The File object
+        :type file: File
+        :param updated_access: Dictionaries with username, read and write keys
+        :type updated_access: list[dict]
+
+        :return: The number of users whose access was set; unknown usernames are skipped
+        :rtype: int
+        """
+        user_ids = self.get_user_ids(access["username"] for access in updated_access)
+        rows = [(user_ids[access["username"]], file.file_id, int(access["read"]), int(access["write"]))
+                for access in updated_access if access["username"] in user_ids]
+        if not rows:
+            return 0
+
+        with self.lock:
+            try:
+                self.cursor.executemany("""
+                    INSERT INTO file_access (user_id, file_id, can_read, can_write)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT(user_id, file_id) DO UPDATE
+                    SET can_read = excluded.can_read, can_write = excluded.can_write
+                """, rows)
+                self.conn.commit()
+            except sqlite3.Error:
+                self.conn.rollback()
+                raise
+            finally:
+                self.permissions.invalidate_file(file.file_id)
+        return len(rows)
+
     def get_users_with_access_to_file(self, file: File) -> list[UserAccess]:
         """
         Retrieve a list of all users who have access to a file, including read and write permissions.
@@ -443,15 +732,15 @@ class Database:
         :return: List of UserAccess objects
         :rtype: list[UserAccess]
         """
-        with self.lock:
-            self.cursor.execute("""
+        with self.reader() as cursor:
+            cursor.execute("""
                 SELECT u.id, u.first_name, u.last_name, u.username, fa.can_read, fa.can_write
                 FROM file_access fa
                 JOIN users u ON fa.user_id = u.id
                 WHERE fa.file_id = ?
             """, (file.file_id,))
 
-            rows = self.cursor.fetchall()
+            rows = cursor.fetchall()
             user_accesses = []
 
             for row in rows:
@@ -481,16 +770,19 @@ class Database:
         :return: True if renamed successfully, False otherwise
         :rtype: bool
         """
-        with self.lock:
+        with self.file_lock(file.file_id), self.lock:
             self.cursor.execute("SELECT path FROM files WHERE id = ?", (file.file_id,))
             result = self.cursor.fetchone()
             if not result:
                 return False  # file not found
 
             old_path = result[0]
+            if not self.is_plain_name(new_filename):
+                return False
             new_path = os.path.join(os.path.dirname(old_path), new_filename)
 
             try:
+                # The journal is keyed by the file id and stays where it is
                 os.rename(old_path, new_path)
                 self.cursor.execute(
                     "UPDATE files SET filename = ?, path = ? WHERE id = ?",
@@ -512,16 +804,18 @@ class Database:
         :return: A tuple containing (first_name, last_name) if the user exists, otherwise None
         :rtype: tuple or None
         """
-        with self.lock:
-            self.cursor.execute("SELECT first_name, last_name FROM users WHERE username=?", (username,))
-            result = self.cursor.fetchone()
+        with self.reader() as cursor:
+            cursor.execute("SELECT first_name, last_name FROM users WHERE username=?", (username,))
+            result = cursor.fetchone()
             return result[0],result[1] if result else None
 
     def close_connection(self):
         """
-        Close the database connection.
+        Close the writer connection and every pooled read connection.
 
         :return: None
         """
         with self.lock:
-            self.conn.close()
\ No newline at end of file
+            self.conn.close()
+        while not self.readers.empty():
+            self.readers.get().close()
\ No newline at end of file
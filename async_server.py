@@ -0,0 +1,189 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import protocol
+from request import Request
+from server import Server, IP_ADDR, PORT, QUEUE_LEN, HANDSHAKE_TIMEOUT, MAX_OUTBOUND_BYTES
+
+EXECUTOR_WORKERS = 16
+
+
+class StreamConnection:
+    """
+    Socket-like wrapper around an asyncio stream so the Server handlers can keep using protocol.send.
+    """
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, loop):
+        """
+        Initialize the connection wrapper.
+
+        :param reader: The stream requests are read from
+        :type reader: asyncio.StreamReader
+        :param writer: The stream responses are written to
+        :type writer: asyncio.StreamWriter
+        :param loop: The event loop that owns the streams
+        :type loop: asyncio.AbstractEventLoop
+        """
+        self.reader = reader
+        self.writer = writer
+        self.loop = loop
+        self.peer = writer.get_extra_info('peername')
+        self.closed = False
+
+    def sendall(self, data: bytes):
+        """
+        Queue data for writing; safe to call from executor threads.
+
+        :param data: The bytes to send
+        :type data: bytes
+
+        :return: None
+        """
+        if self.closed:
+            raise ConnectionError("Connection closed")
+        self.loop.call_soon_threadsafe(self._write, data)
+
+    def _write(self, data: bytes):
+        """
+        Write data to the transport from the event loop thread. Like QueuedConnection, the client
+        is dropped once more than MAX_OUTBOUND_BYTES are already waiting, so a single large frame
+        is always accepted by a client that keeps up.
+
+        :param data: The bytes to send
+        :type data: bytes
+
+        :return: None
+        """
+        if self.closed:
+            return
+        if self.writer.transport.get_write_buffer_size() > MAX_OUTBOUND_BYTES:
+            logging.error(f"Dropping {self.peer}: more than {MAX_OUTBOUND_BYTES} bytes waiting to be sent")
+            self.close()
+            return
+        self.writer.write(data)
+
+    def close(self):
+        """
+        Close the underlying stream.
+
+        :return: None
+        """
+        if not self.closed:
+            self.closed = True
+            self.loop.call_soon_threadsafe(self.writer.close)
+
+    def __repr__(self):
+        return f"<StreamConnection {self.peer}>"
+
+
+class AsyncServer(Server):
+    """
+    Server variant that multiplexes all client connections on one asyncio event loop and runs
+    the blocking database and disk work of the request handlers on a bounded thread pool.
+    """
+    def __init__(self, backlog=QUEUE_LEN, workers=EXECUTOR_WORKERS):
+        """
+        Initialize the server state and the worker pool.
+
+        :param backlog: Listen backlog of the server socket
+        :type backlog: int
+        :param workers: Maximum number of threads running blocking handler work
+        :type workers: int
+        """
+        super().__init__(backlog)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='coedit-worker')
+        self.loop = None
+
+    def start_server(self):
+        """
+        Run the event loop until the server is stopped.
+
+        :return: None
+        """
+        try:
+            asyncio.run(self.serve())
+        finally:
+            self.executor.shutdown(wait=False)
+
+    async def serve(self):
+        """
+        Accept SSL connections; pending changes are broadcast by the scheduler thread.
+
+        :return: None
+        """
+        self.loop = asyncio.get_running_loop()
+        self.documents.start()
+        self.scheduler.start()
+        server = await asyncio.start_server(
+            self.handle_connection, IP_ADDR, PORT, ssl=self.context, backlog=self.backlog,
+            ssl_handshake_timeout=HANDSHAKE_TIMEOUT
+        )
+        async with server:
+            await server.serve_forever()
+
+    async def run_blocking(self, function, *args):
+        """
+        Run a blocking function on the worker pool.
+
+        :param function: The function to run
+        :type function: Callable
+        :param args: Positional arguments for the function
+
+        :return: The function's return value
+        :rtype: Any
+        """
+        return await self.loop.run_in_executor(self.executor, function, *args)
+
+    async def handle_connection(self, reader, writer):
+        """
+        Entry point for every accepted connection.
+
+        :param reader: The stream requests are read from
+        :type reader: asyncio.StreamReader
+        :param writer: The stream responses are written to
+        :type writer: asyncio.StreamWriter
+
+        :return: None
+        """
+        conn = StreamConnection(reader, writer, self.loop)
+        logging.debug(f'received a connection from {conn}')
+        await self.listen(conn)
+
+    async def listen(self, conn):
+        """
+        Continuously read requests from a client and handle them one at a time.
+
+        :param conn: The client connection
+        :type conn: StreamConnection
+
+        :return: None
+        """
+        try:
+            while True:
+                msg = await protocol.async_recv(conn.reader)
+                logging.debug(f'received a msg from {conn}, msg {msg}')
+                await self.handle_request(msg, conn)
+        except (ConnectionError, asyncio.IncompleteReadError) as sock_err:
+            logging.error(sock_err)
+        except Exception as e:
+            logging.error(f"Error handling requests from {conn}: {e}")
+        finally:
+            conn.close()
+            await self.run_blocking(self.cleanup_connection, conn)
+
+    async def handle_request(self, request: Request, conn):
+        """
+        Run the request handler on the worker pool.
+
+        :param request: The incoming request object
+        :type request: Request
+        :param conn: The client connection
+        :type conn: StreamConnection
+
+        :return: None
+        """
+        await self.run_blocking(super().handle_request, request, conn)
+
+
+if __name__ == "__main__":
+    AsyncServer().start_server()
@@ -0,0 +1,122 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+AUTH_WORKERS = 4  # concurrent bcrypt checks; bcrypt releases the GIL so these use separate cores
+MAX_QUEUED = 256  # logins waiting for a worker before new ones are turned away
+
+
+class AuthPool:
+    """
+    Bounded pool that runs bcrypt password checks off the request threads, so a burst of
+    logins neither holds database locks nor starves the workers that handle edits.
+    """
+    def __init__(self, workers=AUTH_WORKERS, max_queued=MAX_QUEUED):
+        """
+        Initialize the pool.
+
+        :param workers: Number of password checks that run at the same time
+        :type workers: int
+        :param max_queued: Number of checks that may wait for a worker
+        :type max_queued: int
+        """
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='auth')
+        self.slots = threading.BoundedSemaphore(workers + max_queued)
+        self.lock = threading.Lock()
+        self.queued = 0
+        self.active = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.total_check = 0.0
+
+    def submit(self, password: str, stored_hash: bytes, callback) -> bool:
+        """
+        Queue a password check; the callback receives the result on a pool thread.
+
+        :param password: The password the client sent
+        :type password: str
+        :param stored_hash: The bcrypt hash stored for the user
+        :type stored_hash: bytes
+        :param callback: Called with True or False once the check finished
+        :type callback: Callable[[bool], None]
+
+        :return: False if the queue is full and the check was not queued
+        :rtype: bool
+        """
+        if not self.slots.acquire(blocking=False):
+            with self.lock:
+                self.rejected += 1
+            return False
+
+        with self.lock:
+            self.queued += 1
+        self.executor.submit(self.check, password, stored_hash, callback, time.monotonic())
+        return True
+
+    def check(self, password: str, stored_hash: bytes, callback, submitted_at: float):
+        """
+        Run one password check on a pool thread and hand the result to the callback.
+
+        :param password: The password the client sent
+        :type password: str
+        :param stored_hash: The bcrypt hash stored for the user
+        :type stored_hash: bytes
+        :param callback: Called with the result
+        :type callback: Callable[[bool], None]
+        :param submitted_at: time.monotonic() when the check was queued
+        :type submitted_at: float
+
+        :return: None
+        """
+        started = time.monotonic()
+        with self.lock:
+            self.queued -= 1
+            self.active += 1
+            self.total_wait += started - submitted_at
+
+        try:
+            matches = bcrypt.checkpw(password.encode('utf-8'), stored_hash)
+        except Exception as e:
+            # A missing or mistyped password from the client; the callback must still run
+            logging.error(f"Password check failed: {e}")
+            matches = False
+        finally:
+            with self.lock:
+                self.active -= 1
+                self.completed += 1
+                self.total_check += time.monotonic() - started
+            self.slots.release()
+
+        try:
+            callback(matches)
+        except Exception as e:
+            logging.error(f"Error finishing login: {e}")
+
+    def stats(self) -> dict:
+        """
+        Return the queueing metrics of the pool.
+
+        :return: Dictionary with queued, active, completed, rejected, avg_wait and avg_check (seconds)
+        :rtype: dict
+        """
+        with self.lock:
+            return {
+                'queued': self.queued,
+                'active': self.active,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'avg_wait': self.total_wait / self.completed if self.completed else 0.0,
+                'avg_check': self.total_check / self.completed if self.completed else 0.0,
+            }
+
+    def shutdown(self):
+        """
+        Stop accepting checks and wait for the running ones.
+
+        :return: None
+        """
+        self.executor.shutdown(wait=True)
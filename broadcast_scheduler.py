@@ -0,0 +1,158 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+QUIET_PERIOD = 0.015  # seconds without new edits after which a document is broadcast
+MAX_DELAY = 0.25  # seconds the oldest pending edit of a busy document may wait
+MAX_PENDING_OPS = 256  # pending operations that trigger an immediate broadcast
+BROADCAST_WORKERS = 4
+RETRY_DELAY = 1.0  # seconds before retrying a document whose changes could not be journaled
+
+
+class BroadcastScheduler:
+    """
+    Decides when each document's pending operations are broadcast. A document is flushed once it
+    has been quiet for QUIET_PERIOD, once its oldest pending edit is MAX_DELAY old or as soon as
+    MAX_PENDING_OPS operations are queued, so idle rooms see edits within milliseconds while busy
+    rooms still get coalesced batches.
+
+    All deadlines live in one heap served by a single thread; the flushes themselves run on a
+    small worker pool so a slow client never delays the deadlines of other documents.
+    """
+    def __init__(self, flush, quiet_period=QUIET_PERIOD, max_delay=MAX_DELAY,
+                 max_pending_ops=MAX_PENDING_OPS, workers=BROADCAST_WORKERS):
+        """
+        Initialize an idle scheduler.
+
+        :param flush: Called with a document when its pending operations are due
+        :type flush: Callable[[LiveDocument], None]
+        :param quiet_period: Seconds without edits after which a document is flushed
+        :type quiet_period: float
+        :param max_delay: Maximum age in seconds of a pending edit
+        :type max_delay: float
+        :param max_pending_ops: Number of pending operations that forces a flush
+        :type max_pending_ops: int
+        :param workers: Number of threads running flushes
+        :type workers: int
+        """
+        self.flush = flush
+        self.quiet_period = quiet_period
+        self.max_delay = max_delay
+        self.max_pending_ops = max_pending_ops
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='broadcast')
+        self.heap = []
+        self.deadlines = {}
+        self.first_pending = {}
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        self.stopped = False
+        self.thread = None
+
+    def start(self):
+        """
+        Start the thread that waits for the next deadline.
+
+        :return: None
+        """
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def schedule(self, doc, pending_ops: int):
+        """
+        Record new pending operations on a document and move its deadline accordingly.
+
+        :param doc: The document that received edits
+        :type doc: LiveDocument
+        :param pending_ops: Number of operations now waiting on the document
+        :type pending_ops: int
+
+        :return: None
+        """
+        now = time.monotonic()
+        with self.condition:
+            first = self.first_pending.setdefault(doc, now)
+            if pending_ops >= self.max_pending_ops:
+                deadline = now
+            else:
+                deadline = min(now + self.quiet_period, first + self.max_delay)
+
+            self.deadlines[doc] = deadline
+            heapq.heappush(self.heap, (deadline, next(self.counter), doc))
+            if self.heap[0][2] is doc:
+                self.condition.notify()
+
+    def retry(self, doc, delay=RETRY_DELAY):
+        """
+        Flush a document again after a delay, e.g. when its changes could not be made durable.
+        New edits may bring the flush forward as usual.
+
+        :param doc: The document to flush again
+        :type doc: LiveDocument
+        :param delay: Seconds to wait
+        :type delay: float
+
+        :return: None
+        """
+        deadline = time.monotonic() + delay
+        with self.condition:
+            if doc in self.deadlines and self.deadlines[doc] <= deadline:
+                return
+            self.first_pending.setdefault(doc, deadline)
+            self.deadlines[doc] = deadline
+            heapq.heappush(self.heap, (deadline, next(self.counter), doc))
+            if self.heap[0][2] is doc:
+                self.condition.notify()
+
+    def run(self):
+        """
+        Hand documents to the worker pool as their deadlines expire, until stopped.
+
+        :return: None
+        """
+        with self.condition:
+            while not self.stopped:
+                if not self.heap:
+                    self.condition.wait()
+                    continue
+
+                deadline, _, doc = self.heap[0]
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    self.condition.wait(delay)
+                    continue
+
+                heapq.heappop(self.heap)
+                # Entries left behind by a later schedule call are skipped
+                if self.deadlines.get(doc) != deadline:
+                    continue
+                del self.deadlines[doc]
+                del self.first_pending[doc]
+                self.executor.submit(self.run_flush, doc)
+
+    def run_flush(self, doc):
+        """
+        Flush one document on a worker thread.
+
+        :param doc: The document to flush
+        :type doc: LiveDocument
+
+        :return: None
+        """
+        try:
+            self.flush(doc)
+        except Exception as e:
+            logging.error(f"Error broadcasting document {doc.file_id}: {e}")
+
+    def stop(self):
+        """
+        Stop the scheduler thread and wait for running flushes; documents still pending are not flushed.
+
+        :return: None
+        """
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        self.executor.shutdown(wait=True)
@@ -3,12 +3,15 @@ import queue
 import socket
 import ssl
 import threading
+import time
 
 import protocol
 from request import Request
 
 HOST_NAME = '127.0.0.1'
 PORT = 8468
+RECONNECT_DELAY = 1.0  # seconds before the first reconnection attempt after the connection dropped
+RECONNECT_MAX_DELAY = 30.0  # upper bound of the doubling delay between attempts
 
 
 class Client:
@@ -26,10 +29,14 @@ class Client:
         self.context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
         self.context.check_hostname = False
         self.context.verify_mode = ssl.CERT_NONE
+        self.tls_session = None
+        self.session_token = None
         self.my_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.conn = self.context.wrap_socket(self.my_socket, server_hostname=HOST_NAME)
 
         self.response_queue = queue.Queue()
+        # Called on the listen thread after each response is queued, to wake the GUI loop
+        self.on_response = None
 
     def connect(self):
         """
@@ -45,21 +52,89 @@ class Client:
             logging.error('failed to connect: ' + str(e))
             quit()
 
+    def reconnect(self):
+        """
+        Opens a new connection to the server, resuming the previous TLS session
+        so the server can skip the full handshake, and the login session so the
+        password is not checked again.
+
+        :raises Exception: If the connection fails.
+        """
+        self.save_tls_session()
+        try:
+            self.conn.close()
+        except Exception as e:
+            logging.error(f"Error closing old connection: {e}")
+
+        self.my_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.conn = self.context.wrap_socket(self.my_socket, server_hostname=HOST_NAME, session=self.tls_session)
+        try:
+            self.conn.connect((HOST_NAME, PORT))
+        except (socket.error, ssl.SSLError):
+            self.conn.close()
+            raise
+        logging.debug(f'reconnected, TLS session reused: {self.conn.session_reused}')
+        self.running = True
+        threading.Thread(target=self.listen, daemon=True).start()
+        if self.session_token:
+            self.send_request(Request('resume-session', self.session_token))
+
+    def restore_connection(self):
+        """
+        Reconnects after the connection dropped, retrying with a doubling delay until it
+        succeeds or the client is stopped. Runs on the listen thread of the lost connection.
+
+        :return: None
+        """
+        delay = RECONNECT_DELAY
+        while self.running:
+            time.sleep(delay)
+            if not self.running:
+                return
+            try:
+                self.reconnect()
+                return
+            except Exception as e:
+                logging.error(f"Reconnection failed, retrying in {delay:.0f} s: {e}")
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+    def save_tls_session(self):
+        """
+        Remembers the current TLS session for resumption on the next connection.
+
+        :return: None
+        """
+        try:
+            if self.conn.session is not None:
+                self.tls_session = self.conn.session
+        except (ValueError, OSError):
+            pass
+
     def listen(self):
         """
         Listens for incoming messages from the server in a loop and stores them
         in the response queue. Runs in a separate thread.
 
-        This method handles exceptions gracefully and stops on errors.
+        If the connection drops while the client is running, it is restored with reconnect.
         """
+        conn = self.conn
+        session_saved = False
         while self.running:
             try:
-                response = protocol.recv(self.conn)
+                response = protocol.recv(conn)
+                if not session_saved:
+                    # TLS 1.3 tickets arrive after the handshake, with the first data read
+                    self.save_tls_session()
+                    session_saved = True
                 self.response_queue.put(response)
-                logging.debug(f'received a msg from {self.conn}')
+                logging.debug(f'received a msg from {conn}')
+                if self.on_response:
+                    self.on_response()
             except Exception as e:
                 logging.error(f"Error in listen: {e}")
                 break
+        if self.running and conn is self.conn:
+            self.restore_connection()
 
     def send_request(self, request: Request):
         """
@@ -93,6 +168,7 @@ class Client:
         :return: None
         """
         self.running = False
+        self.save_tls_session()
         self.conn.close()
 
     def disconnect(self):
@@ -0,0 +1,398 @@
+import struct
+from datetime import datetime
+
+from file import File
+from operation import Operation
+from request import Request
+from user import User
+from user_access import UserAccess
+
+CODEC_VERSION = 2
+SUPPORTED_VERSIONS = (1, 2)  # version 1 operations carry no origin
+
+TAG_NONE = 0x00
+TAG_TRUE = 0x01
+TAG_FALSE = 0x02
+TAG_INT = 0x03
+TAG_FLOAT = 0x04
+TAG_STR = 0x05
+TAG_BYTES = 0x06
+TAG_LIST = 0x07
+TAG_TUPLE = 0x08
+TAG_DICT = 0x09
+TAG_DATETIME = 0x0A
+TAG_REQUEST = 0x10
+TAG_OPERATION = 0x11
+TAG_FILE = 0x12
+TAG_USER = 0x13
+TAG_USER_ACCESS = 0x14
+
+OP_TYPES = ('insert', 'delete')
+OP_TYPE_CODES = {op_type: code for code, op_type in enumerate(OP_TYPES)}
+
+FLOAT = struct.Struct('!d')
+MAX_DEPTH = 64  # deepest nesting of containers and objects a message may have
+
+
+class CodecError(ValueError):
+    """
+    Raised when a value cannot be encoded or a message cannot be decoded.
+    """
+
+
+def encode(value) -> bytes:
+    """
+    Encode a value into the versioned tagged binary format.
+
+    :param value: A Request, Operation, File, User, UserAccess or a plain value/container of them
+    :type value: Any
+
+    :return: The encoded message
+    :rtype: bytes
+    """
+    out = bytearray((CODEC_VERSION,))
+    _encode_value(out, value)
+    return bytes(out)
+
+
+def decode(data):
+    """
+    Decode a message produced by encode.
+
+    :param data: The encoded message
+    :type data: bytes or memoryview
+
+    :return: The decoded value
+    :rtype: Any
+    """
+    reader = _Reader(data)
+    reader.version = reader.byte()
+    if reader.version not in SUPPORTED_VERSIONS:
+        raise CodecError(f"Unsupported codec version {reader.version}")
+    try:
+        value = reader.value()
+    except (UnicodeDecodeError, ValueError, TypeError, OverflowError, RecursionError) as e:
+        if isinstance(e, CodecError):
+            raise
+        # Invalid UTF-8, a bad datetime, an unhashable dict key and the like
+        raise CodecError(f"Malformed value: {e}") from e
+    if reader.pos != len(reader.data):
+        raise CodecError("Trailing bytes after message")
+    return value
+
+
+def _write_varint(out: bytearray, number: int):
+    """
+    Append an unsigned LEB128 varint.
+
+    :param out: The output buffer
+    :type out: bytearray
+    :param number: A non-negative integer
+    :type number: int
+    """
+    while number > 0x7F:
+        out.append((number & 0x7F) | 0x80)
+        number >>= 7
+    out.append(number)
+
+
+def _write_str(out: bytearray, text: str):
+    """
+    Append a length-prefixed UTF-8 string.
+
+    :param out: The output buffer
+    :type out: bytearray
+    :param text: The string to write
+    :type text: str
+    """
+    encoded = text.encode('utf-8', 'surrogatepass')
+    _write_varint(out, len(encoded))
+    out += encoded
+
+
+def _encode_value(out: bytearray, value):
+    """
+    Append a tagged value, dispatching on its exact type.
+
+    :param out: The output buffer
+    :type out: bytearray
+    :param value: The value to encode
+    :type value: Any
+    """
+    encoder = _ENCODERS.get(type(value))
+    if encoder is None:
+        raise CodecError(f"Cannot encode value of type {type(value).__name__}")
+    encoder(out, value)
+
+
+def _encode_none(out, value):
+    out.append(TAG_NONE)
+
+
+def _encode_bool(out, value):
+    out.append(TAG_TRUE if value else TAG_FALSE)
+
+
+def _encode_int(out, value):
+    out.append(TAG_INT)
+    _write_varint(out, value * 2 if value >= 0 else -value * 2 - 1)
+
+
+def _encode_float(out, value):
+    out.append(TAG_FLOAT)
+    out += FLOAT.pack(value)
+
+
+def _encode_str(out, value):
+    out.append(TAG_STR)
+    _write_str(out, value)
+
+
+def _encode_bytes(out, value):
+    out.append(TAG_BYTES)
+    _write_varint(out, len(value))
+    out += value
+
+
+def _encode_sequence(tag):
+    def encoder(out, value):
+        out.append(tag)
+        _write_varint(out, len(value))
+        for item in value:
+            _encode_value(out, item)
+    return encoder
+
+
+def _encode_dict(out, value):
+    out.append(TAG_DICT)
+    _write_varint(out, len(value))
+    for key, item in value.items():
+        _encode_value(out, key)
+        _encode_value(out, item)
+
+
+def _encode_datetime(out, value):
+    out.append(TAG_DATETIME)
+    _write_str(out, value.isoformat())
+
+
+def _encode_request(out, request: Request):
+    out.append(TAG_REQUEST)
+    _write_str(out, request.request_type)
+    _encode_value(out, request.data)
+
+
+def _encode_operation(out, op: Operation):
+    out.append(TAG_OPERATION)
+    out.append(OP_TYPE_CODES[op.op_type])
+    _write_str(out, op.text)
+    _write_varint(out, op.line)
+    _write_varint(out, op.char)
+    out += FLOAT.pack(op.timestamp)
+    _encode_value(out, op.origin)
+
+
+def _encode_user(out, user: User, include_password=True):
+    out.append(TAG_USER)
+    _encode_value(out, user.user_id)
+    _encode_value(out, user.first_name)
+    _encode_value(out, user.last_name)
+    _encode_value(out, user.username)
+    _encode_value(out, user.password if include_password else None)
+
+
+def _encode_file(out, file: File):
+    out.append(TAG_FILE)
+    _write_str(out, file.file_id)
+    _write_str(out, file.filename)
+    # The owner is only needed for display and ownership checks, never its credentials
+    _encode_user(out, file.owner, include_password=False)
+    _encode_value(out, file.path)
+    _encode_value(out, file.creation_date)
+
+
+def _encode_user_access(out, user_access: UserAccess):
+    out.append(TAG_USER_ACCESS)
+    _encode_value(out, user_access.file)
+    _encode_user(out, user_access.user, include_password=False)
+    out.append(TAG_TRUE if user_access.can_read else TAG_FALSE)
+    out.append(TAG_TRUE if user_access.can_write else TAG_FALSE)
+
+
+_ENCODERS = {
+    type(None): _encode_none,
+    bool: _encode_bool,
+    int: _encode_int,
+    float: _encode_float,
+    str: _encode_str,
+    bytes: _encode_bytes,
+    list: _encode_sequence(TAG_LIST),
+    tuple: _encode_sequence(TAG_TUPLE),
+    dict: _encode_dict,
+    datetime: _encode_datetime,
+    Request: _encode_request,
+    Operation: _encode_operation,
+    File: _encode_file,
+    User: _encode_user,
+    UserAccess: _encode_user_access,
+}
+
+
+class _Reader:
+    """
+    Cursor over an encoded message.
+    """
+    def __init__(self, data):
+        self.data = memoryview(data)
+        self.pos = 0
+        self.version = CODEC_VERSION
+        self.depth = 0
+
+    def byte(self) -> int:
+        """
+        Read a single unsigned byte.
+        """
+        if self.pos >= len(self.data):
+            raise CodecError("Truncated message")
+        value = self.data[self.pos]
+        self.pos += 1
+        return value
+
+    def varint(self) -> int:
+        """
+        Read an unsigned LEB128 varint.
+        """
+        number = 0
+        shift = 0
+        while True:
+            byte = self.byte()
+            number |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                return number
+            shift += 7
+
+    def raw(self, length: int) -> memoryview:
+        """
+        Read length bytes as a zero-copy slice of the message.
+        """
+        end = self.pos + length
+        if end > len(self.data):
+            raise CodecError("Truncated message")
+        chunk = self.data[self.pos:end]
+        self.pos = end
+        return chunk
+
+    def str(self) -> str:
+        """
+        Read a length-prefixed UTF-8 string.
+        """
+        return str(self.raw(self.varint()), 'utf-8', 'surrogatepass')
+
+    def float(self) -> float:
+        """
+        Read a big-endian double.
+        """
+        return FLOAT.unpack(self.raw(FLOAT.size))[0]
+
+    def expect(self, tag: int):
+        """
+        Read a tag byte and fail unless it matches.
+        """
+        if self.byte() != tag:
+            raise CodecError(f"Expected tag {tag:#x}")
+
+    def value(self):
+        """
+        Read one tagged value.
+        """
+        tag = self.byte()
+        decoder = _DECODERS.get(tag)
+        if decoder is None:
+            raise CodecError(f"Unknown tag {tag:#x}")
+        if self.depth >= MAX_DEPTH:
+            raise CodecError("Message nested too deeply")
+        self.depth += 1
+        try:
+            return decoder(self)
+        finally:
+            self.depth -= 1
+
+    def user(self) -> User:
+        """
+        Read a tagged User.
+        """
+        self.expect(TAG_USER)
+        return _decode_user(self)
+
+
+def _decode_int(reader: _Reader):
+    number = reader.varint()
+    return number >> 1 if not number & 1 else -((number + 1) >> 1)
+
+
+def _decode_dict(reader: _Reader):
+    result = {}
+    for _ in range(reader.varint()):
+        key = reader.value()
+        result[key] = reader.value()
+    return result
+
+
+def _decode_request(reader: _Reader):
+    request_type = reader.str()
+    return Request(request_type, reader.value())
+
+
+def _decode_operation(reader: _Reader):
+    code = reader.byte()
+    if code >= len(OP_TYPES):
+        raise CodecError(f"Unknown operation type {code}")
+    text = reader.str()
+    line = reader.varint()
+    char = reader.varint()
+    timestamp = reader.float()
+    origin = reader.value() if reader.version >= 2 else None
+    return Operation(OP_TYPES[code], text, line, char, timestamp, origin)
+
+
+def _decode_user(reader: _Reader):
+    user_id = reader.value()
+    first_name = reader.value()
+    last_name = reader.value()
+    username = reader.value()
+    return User(user_id, first_name, last_name, username, reader.value())
+
+
+def _decode_file(reader: _Reader):
+    file_id = reader.str()
+    filename = reader.str()
+    owner = reader.user()
+    path = reader.value()
+    return File(filename, owner, path, creation_date=reader.value(), file_id=file_id)
+
+
+def _decode_user_access(reader: _Reader):
+    file = reader.value()
+    user = reader.user()
+    can_read = reader.byte() == TAG_TRUE
+    return UserAccess(file, user, can_read, reader.byte() == TAG_TRUE)
+
+
+_DECODERS = {
+    TAG_NONE: lambda reader: None,
+    TAG_TRUE: lambda reader: True,
+    TAG_FALSE: lambda reader: False,
+    TAG_INT: _decode_int,
+    TAG_FLOAT: lambda reader: reader.float(),
+    TAG_STR: lambda reader: reader.str(),
+    TAG_BYTES: lambda reader: bytes(reader.raw(reader.varint())),
+    TAG_LIST: lambda reader: [reader.value() for _ in range(reader.varint())],
+    TAG_TUPLE: lambda reader: tuple(reader.value() for _ in range(reader.varint())),
+    TAG_DICT: _decode_dict,
+    TAG_DATETIME: lambda reader: datetime.fromisoformat(reader.str()),
+    TAG_REQUEST: _decode_request,
+    TAG_OPERATION: _decode_operation,
+    TAG_FILE: _decode_file,
+    TAG_USER: _decode_user,
+    TAG_USER_ACCESS: _decode_user_access,
+}
@@ -0,0 +1,76 @@
+import pickle
+import time
+
+import codec
+from file import File
+from operation import Operation
+from request import Request
+from user import User
+from user_access import UserAccess
+
+ITERATIONS = 20000
+
+
+def sample_messages():
+    """
+    Build representative messages for the most common request types.
+
+    :return: Mapping of message name to the Request object
+    :rtype: dict[str, Request]
+    """
+    owner = User(1, 'Ada', 'Lovelace', 'ada', b'$2b$12$' + b'x' * 53)
+    file = File('notes.txt', owner, 'CoEdit_users/ada/notes.txt', creation_date='2025-01-01 10:00:00')
+    keystroke = [Operation('insert', 'a', 12, 40)]
+    burst = [Operation('insert', c, 12, 40 + i) for i, c in enumerate('hello world')]
+    files = [File(f'file{i}.txt', User(i, 'First', 'Last', f'user{i}', ''), f'CoEdit_users/user{i}/file{i}.txt',
+                  creation_date='2025-01-01 10:00:00') for i in range(50)]
+    accesses = [UserAccess(file, User(i, 'First', 'Last', f'user{i}', ''), True, i % 2 == 0) for i in range(20)]
+
+    return {
+        'keystroke update': Request('file-content-update', [file, keystroke, owner]),
+        'typing burst update': Request('file-content-update', [file, burst, owner]),
+        'broadcast update': Request('file-content-update', [file, burst]),
+        'file list (50 files)': Request('file-list', files),
+        'access list (20 users)': Request('file-access', accesses),
+        'open file (10 KB)': Request('file-content', [file, 'x' * 10240]),
+    }
+
+
+def measure(function, argument, iterations=ITERATIONS):
+    """
+    Time a function call over a number of iterations.
+
+    :param function: The function to time
+    :type function: Callable
+    :param argument: The argument passed to the function
+    :type argument: Any
+    :param iterations: Number of calls
+    :type iterations: int
+
+    :return: Average microseconds per call
+    :rtype: float
+    """
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function(argument)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main():
+    """
+    Print bytes per message and encode/decode time for pickle and the codec.
+
+    :return: None
+    """
+    print(f"{'message':<24}{'pickle B':>10}{'codec B':>10}"
+          f"{'pickle enc us':>15}{'codec enc us':>14}{'pickle dec us':>15}{'codec dec us':>14}")
+    for name, message in sample_messages().items():
+        pickled = pickle.dumps(message)
+        encoded = codec.encode(message)
+        print(f"{name:<24}{len(pickled):>10}{len(encoded):>10}"
+              f"{measure(pickle.dumps, message):>15.2f}{measure(codec.encode, message):>14.2f}"
+              f"{measure(pickle.loads, pickled):>15.2f}{measure(codec.decode, encoded):>14.2f}")
+
+
+if __name__ == '__main__':
+    main()
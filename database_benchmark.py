@@ -0,0 +1,176 @@
+import contextlib
+import io
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import bcrypt
+
+from SQLite_database import Database
+from file import File
+from operation import Operation
+from user import User
+
+USERS = 100000
+FILES = 10000
+ACCESS_ROWS = 1000000
+ITERATIONS = 200
+BATCH = 10000  # rows per executemany while populating
+SEED = 1
+
+
+def populate(database: Database):
+    """
+    Fill an empty database with USERS users, FILES files and ACCESS_ROWS access rows.
+    Rows are inserted directly so populating does not pay for a bcrypt hash per user.
+
+    :param database: The empty database
+    :type database: Database
+
+    :return: None
+    """
+    rng = random.Random(SEED)
+    hashed = bcrypt.hashpw(b'password', bcrypt.gensalt())
+    with database.lock:
+        database.cursor.executemany(
+            "INSERT INTO users (first_name, last_name, username, password) VALUES (?, ?, ?, ?)",
+            ((f'First{i}', f'Last{i}', f'user{i}', hashed) for i in range(USERS)))
+        database.cursor.executemany(
+            "INSERT INTO files (id, owner_id, filename, path) VALUES (?, ?, ?, ?)",
+            ((f'file{i}', i % USERS + 1, f'file{i}.txt', os.path.join('CoEdit_users', f'file{i}.txt'))
+             for i in range(FILES)))
+
+        per_user = ACCESS_ROWS // USERS
+        rows = []
+        for user_id in range(1, USERS + 1):
+            for file_number in rng.sample(range(FILES), per_user):
+                rows.append((user_id, f'file{file_number}', 1, rng.random() < 0.5))
+            if len(rows) >= BATCH:
+                database.cursor.executemany(
+                    "INSERT OR IGNORE INTO file_access (user_id, file_id, can_read, can_write) VALUES (?, ?, ?, ?)",
+                    rows)
+                rows = []
+        database.cursor.executemany(
+            "INSERT OR IGNORE INTO file_access (user_id, file_id, can_read, can_write) VALUES (?, ?, ?, ?)", rows)
+        database.conn.commit()
+        database.cursor.execute("ANALYZE")
+
+    os.makedirs('CoEdit_users', exist_ok=True)
+    for i in range(FILES):
+        with open(os.path.join('CoEdit_users', f'file{i}.txt'), 'w') as f:
+            f.write('line\n' * 100)
+
+
+def measure(function, arguments, iterations=ITERATIONS):
+    """
+    Time a function over a number of calls with varying arguments.
+
+    :param function: The function to time
+    :type function: Callable
+    :param arguments: Called with the call number, returns the positional arguments of that call
+    :type arguments: Callable[[int], tuple]
+    :param iterations: Number of calls
+    :type iterations: int
+
+    :return: Tuple of (median, 99th percentile) microseconds per call
+    :rtype: tuple[float, float]
+    """
+    timings = []
+    with contextlib.redirect_stdout(io.StringIO()):  # some methods print diagnostics
+        for i in range(iterations):
+            args = arguments(i)
+            start = time.perf_counter()
+            function(*args)
+            timings.append((time.perf_counter() - start) * 1e6)
+    timings.sort()
+    return timings[len(timings) // 2], timings[min(len(timings) - 1, len(timings) * 99 // 100)]
+
+
+def cases(database: Database):
+    """
+    Build the calls to time, one or more per public Database method.
+
+    :param database: The populated database
+    :type database: Database
+
+    :return: Mapping of case name to (function, arguments, iterations)
+    :rtype: dict[str, tuple]
+    """
+    rng = random.Random(SEED)
+
+    def user(i):
+        user_id = rng.randrange(USERS) + 1
+        return User(user_id, '', '', f'user{user_id - 1}', 'password')
+
+    def file(i):
+        number = rng.randrange(FILES)
+        return File(f'file{number}.txt', None, '', file_id=f'file{number}')
+
+    def new_user(i):
+        return User(None, 'New', 'User', f'new{i}', b'hash')
+
+    owner = User(1, 'First0', 'Last0', 'user0', 'password')
+    owned = [File(f'bench{i}.txt', owner, '') for i in range(ITERATIONS)]
+    deleted = [File(f'bench-del{i}.txt', owner, '') for i in range(ITERATIONS)]
+    team = [{'username': f'user{i}', 'read': True, 'write': i % 2 == 0} for i in range(300)]
+    edit = [Operation('insert', 'x', 0, 0)]
+
+    return {
+        'add_user': (database.add_user, lambda i: (new_user(i),), ITERATIONS),
+        'get_login': (database.get_login, lambda i: (user(i).username,), ITERATIONS),
+        'verify_user (bcrypt)': (database.verify_user, lambda i: (user(i),), 10),
+        'get_user_id': (database.get_user_id, lambda i: (user(i).username,), ITERATIONS),
+        'get_user_ids (300 names)': (database.get_user_ids, lambda i: ([f'user{rng.randrange(USERS)}' for _ in range(300)],), ITERATIONS),
+        'check_if_user_exists_by_username': (database.check_if_user_exists_by_username, lambda i: (user(i).username,), ITERATIONS),
+        'get_user_full_name': (database.get_user_full_name, lambda i: (user(i).username,), ITERATIONS),
+        'get_permissions (uncached)': (database.get_permissions, lambda i: (user(i), file(i)), ITERATIONS),
+        'get_permissions (cached)': (database.get_permissions, lambda i: (owner, File('', None, '', file_id='file0')), ITERATIONS),
+        'can_user_read': (database.can_user_read, lambda i: (user(i), file(i)), ITERATIONS),
+        'check_write': (database.check_write, lambda i: (user(i), file(i)), ITERATIONS),
+        'get_readable_files_per_user': (database.get_readable_files_per_user, lambda i: (user(i),), ITERATIONS),
+        'get_users_with_access_to_file': (database.get_users_with_access_to_file, lambda i: (file(i),), ITERATIONS),
+        'add_file': (database.add_file, lambda i: (owner, owned[i], ''), ITERATIONS),
+        'add_file_access': (database.add_file_access, lambda i: (owner, owned[i], True, True), ITERATIONS),
+        'change_file_access': (database.change_file_access, lambda i: (user(i), owned[i], True, False), ITERATIONS),
+        'update_file_access (300 users)': (database.update_file_access, lambda i: (owned[i], team), 20),
+        'get_file_content': (database.get_file_content, lambda i: (owner, owned[i]), ITERATIONS),
+        'update_file_content': (database.update_file_content, lambda i: (owner, owned[i], 'text\n' * 100), ITERATIONS),
+        'save_file_content': (database.save_file_content, lambda i: (owned[i].file_id, 'text\n' * 100), ITERATIONS),
+        'append_file_changes': (database.append_file_changes, lambda i: (owned[i].file_id, edit), ITERATIONS),
+        'rename_file': (database.rename_file, lambda i: (owned[i], f'renamed{i}.txt'), ITERATIONS),
+        'delete_file (setup)': (database.add_file, lambda i: (owner, deleted[i], ''), ITERATIONS),
+        'delete_file': (database.delete_file, lambda i: (deleted[i], owner), ITERATIONS),
+    }
+
+
+def main():
+    """
+    Populate a scratch database and print the median and p99 latency of every public Database method.
+
+    :return: None
+    """
+    directory = tempfile.mkdtemp(prefix='coedit-db-benchmark-')
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        database = Database(os.path.join(directory, 'users.db'))
+        start = time.perf_counter()
+        populate(database)
+        print(f"populated {USERS} users, {FILES} files, {ACCESS_ROWS} access rows "
+              f"in {time.perf_counter() - start:.1f} s")
+
+        print(f"{'method':<36}{'median us':>12}{'p99 us':>12}")
+        for name, (function, arguments, iterations) in cases(database).items():
+            median, p99 = measure(function, arguments, iterations)
+            if not name.endswith('(setup)'):
+                print(f"{name:<36}{median:>12.1f}{p99:>12.1f}")
+        database.close_connection()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
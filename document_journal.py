@@ -0,0 +1,295 @@
+import hashlib
+import os
+import struct
+import tempfile
+import zlib
+
+import codec
+from text_buffer import TextBuffer
+
+JOURNAL_DIR = 'CoEdit_journals'  # owned by the server; outside the directories users name files in
+JOURNAL_SUFFIX = '.journal'
+TEMP_SUFFIX = '.coedit-tmp'
+FILE_MODE = 0o644  # permissions of new documents; rewritten documents keep theirs
+JOURNAL_MAGIC = b'CEJ1'
+HEADER = struct.Struct('!4sQI')  # magic, snapshot length in bytes, snapshot crc32
+RECORD = struct.Struct('!II')  # payload length, payload crc32
+COMPACT_THRESHOLD = 1024 * 1024  # journal bytes after which the document is rolled into a new snapshot
+
+# On-disk format of a document: the file itself is the latest snapshot and a journal in JOURNAL_DIR,
+# named after a hash of the file id, holds the operations applied since, one record per flushed
+# batch. Temp files of atomic writes live in JOURNAL_DIR as well, so no name a user picks for a
+# document can collide with a file the server creates.
+#
+# The journal header names the length and crc32 of the snapshot it continues. If the snapshot is
+# rewritten without the journal being dropped (a crash between the two, or an old-style full write),
+# the header no longer matches and the stale journal is ignored. A torn record at the end of the
+# journal, left by a crash during an append, ends the replay.
+
+
+def journal_path(file_id: str) -> str:
+    """
+    Return the path of the journal that belongs to a document. File ids come from clients, so
+    they are hashed instead of being used as a file name.
+
+    :param file_id: The id of the document
+    :type file_id: str
+
+    :return: The journal path
+    :rtype: str
+    """
+    return os.path.join(JOURNAL_DIR, hashlib.sha256(file_id.encode('utf-8')).hexdigest() + JOURNAL_SUFFIX)
+
+
+def decode_snapshot(data: bytes) -> str:
+    """
+    Decode snapshot bytes the way the file used to be read in text mode.
+    """
+    return data.decode('utf-8').replace('\r\n', '\n').replace('\r', '\n')
+
+
+def snapshot_header(data: bytes) -> bytes:
+    """
+    Build the journal header for a snapshot.
+    """
+    return HEADER.pack(JOURNAL_MAGIC, len(data), zlib.crc32(data))
+
+
+def read_records(file_id: str, data: bytes):
+    """
+    Return the batches journaled on top of a snapshot.
+
+    :param file_id: The id of the document
+    :type file_id: str
+    :param data: The snapshot bytes
+    :type data: bytes
+
+    :return: The journaled batches of operations in order; empty if there is no matching journal
+    :rtype: list[list[Operation]]
+    """
+    try:
+        with open(journal_path(file_id), 'rb') as f:
+            journal = f.read()
+    except FileNotFoundError:
+        return []
+
+    if len(journal) < HEADER.size or journal[:HEADER.size] != snapshot_header(data):
+        return []
+
+    batches = []
+    offset = HEADER.size
+    while offset + RECORD.size <= len(journal):
+        length, crc = RECORD.unpack_from(journal, offset)
+        payload = journal[offset + RECORD.size:offset + RECORD.size + length]
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            break
+        batches.append(codec.decode(payload))
+        offset += RECORD.size + length
+    return batches
+
+
+def read_document(path: str, file_id: str) -> str:
+    """
+    Reconstruct the latest content of a document from its snapshot and journal.
+
+    :param path: The path of the document snapshot
+    :type path: str
+    :param file_id: The id of the document
+    :type file_id: str
+
+    :return: The document content
+    :rtype: str
+    :raises FileNotFoundError: If the snapshot does not exist
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    batches = read_records(file_id, data)
+    if not batches:
+        return decode_snapshot(data)
+
+    buffer = TextBuffer(decode_snapshot(data))
+    for changes in batches:
+        for op in changes:
+            op.apply_to(buffer)
+    return buffer.getvalue()
+
+
+def fsync_directory(path: str):
+    """
+    Persist the entries of a directory, so a file created or renamed in it survives a crash.
+    """
+    directory = os.open(path or '.', os.O_RDONLY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
+
+
+def atomic_write(path: str, data: bytes):
+    """
+    Replace a file so that after a crash it holds either the old or the new data, never a mix.
+    The data is staged in a uniquely named temp file in JOURNAL_DIR, on the same file system.
+
+    :param path: The path of the file
+    :type path: str
+    :param data: The new file content
+    :type data: bytes
+
+    :return: None
+    """
+    os.makedirs(JOURNAL_DIR, exist_ok=True)
+    try:
+        mode = os.stat(path).st_mode & 0o777
+    except FileNotFoundError:
+        mode = FILE_MODE
+    fd, temp_path = tempfile.mkstemp(suffix=TEMP_SUFFIX, dir=JOURNAL_DIR)
+    try:
+        os.fchmod(fd, mode)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    # Persist the rename itself
+    fsync_directory(os.path.dirname(path))
+
+
+def append(path: str, file_id: str, changes, sync=True) -> int:
+    """
+    Append one batch of operations to a document's journal, creating the journal if needed.
+
+    :param path: The path of the document snapshot
+    :type path: str
+    :param file_id: The id of the document
+    :type file_id: str
+    :param changes: The operations applied since the last record
+    :type changes: list[Operation]
+    :param sync: Whether to fsync the journal before returning
+    :type sync: bool
+
+    :return: The size of the journal in bytes
+    :rtype: int
+    """
+    payload = codec.encode(list(changes))
+    record = RECORD.pack(len(payload), zlib.crc32(payload)) + payload
+
+    journal = journal_path(file_id)
+    try:
+        new = os.path.getsize(journal) == 0
+    except FileNotFoundError:
+        new = True
+    if new:
+        os.makedirs(JOURNAL_DIR, exist_ok=True)
+        with open(path, 'rb') as f:
+            record = snapshot_header(f.read()) + record
+
+    with open(journal, 'ab') as f:
+        if new and sync:
+            # The records of a new journal are only durable once its directory entry is; an
+            # empty journal left by a failure here gets its header on the next append
+            fsync_directory(JOURNAL_DIR)
+        start = f.tell()
+        try:
+            f.write(record)
+            f.flush()
+            if sync:
+                os.fsync(f.fileno())
+        except OSError:
+            # Never leave a torn record that would hide the records appended after it
+            f.truncate(start)
+            raise
+        return f.tell()
+
+
+def write_snapshot(path: str, file_id: str, content: str):
+    """
+    Atomically replace a document's snapshot with its full content and drop the journal it replaces.
+
+    :param path: The path of the document snapshot
+    :type path: str
+    :param file_id: The id of the document
+    :type file_id: str
+    :param content: The full document content
+    :type content: str
+
+    :return: None
+    """
+    atomic_write(path, content.encode('utf-8'))
+
+    # A crash before the journal is removed leaves a header that no longer matches the snapshot
+    remove(file_id)
+
+
+def remove(file_id: str):
+    """
+    Delete a document's journal if it has one.
+
+    :param file_id: The id of the document
+    :type file_id: str
+
+    :return: None
+    """
+    try:
+        os.remove(journal_path(file_id))
+    except FileNotFoundError:
+        pass
+
+
+def recover(path: str, file_id: str) -> bool:
+    """
+    Fold the journal of a document into a new snapshot, dropping a stale journal or a torn tail.
+
+    :param path: The path of the document snapshot
+    :type path: str
+    :param file_id: The id of the document
+    :type file_id: str
+
+    :return: True if a journal was folded or dropped
+    :rtype: bool
+    """
+    if not os.path.exists(journal_path(file_id)):
+        return False
+
+    try:
+        content = read_document(path, file_id)
+    except FileNotFoundError:
+        remove(file_id)
+        return True
+    write_snapshot(path, file_id, content)
+    return True
+
+
+def recover_all(documents) -> int:
+    """
+    Recovery pass run at startup: fold every journal left behind by documents that were open
+    when the server stopped into their snapshots. Only JOURNAL_DIR is cleaned up: half-written
+    temp files and journals of documents that no longer exist are removed, and files in the
+    users' directories are never touched.
+
+    :param documents: The (file id, snapshot path) of every document
+    :type documents: Iterable[tuple[str, str]]
+
+    :return: The number of documents recovered
+    :rtype: int
+    """
+    recovered = 0
+    journals = set()
+    for file_id, path in documents:
+        journals.add(os.path.basename(journal_path(file_id)))
+        if recover(path, file_id):
+            recovered += 1
+
+    try:
+        filenames = os.listdir(JOURNAL_DIR)
+    except FileNotFoundError:
+        return recovered
+    for filename in filenames:
+        if filename.endswith(TEMP_SUFFIX) or (filename.endswith(JOURNAL_SUFFIX) and filename not in journals):
+            os.remove(os.path.join(JOURNAL_DIR, filename))
+    return recovered
@@ -0,0 +1,541 @@
+import itertools
+import logging
+import threading
+from collections import deque
+
+from document_journal import COMPACT_THRESHOLD
+from file import File
+from ot import transform_lists
+from text_buffer import TextBuffer
+from user import User
+
+FLUSH_INTERVAL = 5.0  # seconds between write-behind flushes of dirty documents
+DURABILITY_OP = 'op'  # every accepted batch is journaled and fsynced before it is broadcast
+DURABILITY_GROUP = 'group'  # the batches of one broadcast share a single journal append and fsync
+DURABILITY_INTERVAL = 'interval'  # write-behind every FLUSH_INTERVAL; a crash loses at most that much
+DURABILITY = DURABILITY_GROUP
+HISTORY_LIMIT = 500  # applied batches kept to transform edits made on older revisions
+
+_origins = itertools.count(1)  # ids of subscriptions, unique across documents and connections
+
+
+class StaleRevisionError(Exception):
+    """
+    Raised when an edit is based on a revision the document no longer keeps history for, or
+    comes from a connection that has not opened the document. The sender is sent the current content.
+    """
+
+
+class LiveDocument:
+    """
+    In-memory state of a file that is currently open by at least one client: its content, the
+    connections subscribed to it and the operations waiting to be broadcast. All of it is guarded
+    by the document's own lock, so edits and broadcasts of different files never contend.
+
+    Each subscribed connection has an origin id that tags the batches it sends, so a client tells
+    its own batches from others' even when the same user has the document open twice.
+
+    Every applied batch gets the next revision number. Batches based on an older revision are
+    transformed against the batches applied since, which are kept for the last HISTORY_LIMIT revisions.
+    """
+    def __init__(self, file: File, content: str, revision=0):
+        """
+        Initialize a live document with the content loaded from disk.
+
+        :param file: The file the document belongs to
+        :type file: File
+        :param content: The current content of the file
+        :type content: str
+        :param revision: The revision the content is at
+        :type revision: int
+        """
+        self.file_id = file.file_id
+        self.file = file
+        self.buffer = TextBuffer(content)
+        self.dirty = False
+        self.closed = False
+        self.revision = revision
+        self.history = deque(maxlen=HISTORY_LIMIT)
+        self.subscribers = []  # (user, connection, origin)
+        self.pending = []
+        self.pending_ops = 0
+        self.unsaved = []  # applied operations not yet written to the journal
+        self.compaction_due = False  # the journal outgrew COMPACT_THRESHOLD
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.broadcast_lock = threading.Lock()
+
+    def apply(self, file: File, changes, base_revision, conn):
+        """
+        Transform a batch of operations against the batches applied since its base revision,
+        apply it to the in-memory content and queue it for broadcast, tagged with the origin of
+        the connection that sent it.
+
+        :param file: The file as sent by the editing client
+        :type file: File
+        :param changes: The operations to apply, in order
+        :type changes: list[Operation]
+        :param base_revision: The revision the client made the changes on, None for the current one
+        :type base_revision: int or None
+        :param conn: The connection the changes came from
+        :type conn: ssl.SSLSocket
+
+        :return: The revision of the batch, or None if the document was closed before it could be applied
+        :rtype: int or None
+        :raises StaleRevisionError: If the base revision is older than the kept history or the connection is not subscribed
+        """
+        with self.lock:
+            if self.closed:
+                return None
+
+            origin = self.origin_of(conn)
+            if origin is None:
+                # The sender would never see its batch acknowledged
+                raise StaleRevisionError(f"{self.file_id}: edit from a connection that did not open it")
+            behind = 0 if base_revision is None else self.revision - base_revision
+            if behind < 0 or behind > len(self.history):
+                raise StaleRevisionError(f"{self.file_id}: revision {base_revision}, current {self.revision}")
+            if behind:
+                concurrent = [op for _, ops in itertools.islice(self.history, len(self.history) - behind, None)
+                              for op in ops]
+                changes, _ = transform_lists(changes, concurrent, False)
+
+            for op in changes:
+                op.origin = origin
+                op.apply_to(self.buffer)
+            self.revision += 1
+            self.history.append((self.revision, changes))
+            self.pending.append([self.revision, origin, changes])
+            self.pending_ops += len(changes)
+            self.unsaved.extend(changes)
+            self.dirty = True
+            self.file = file
+            return self.revision
+
+    def subscribe(self, user: User, conn):
+        """
+        Register a connection for updates and return the content it starts from. A connection
+        that opens the document again keeps its origin.
+
+        :param user: The user opening the document
+        :type user: User
+        :param conn: The connection of the user
+        :type conn: ssl.SSLSocket
+
+        :return: Tuple of (content, revision, origin), or None if the document was closed meanwhile
+        :rtype: tuple[str, int, int] or None
+        """
+        with self.lock:
+            if self.closed:
+                return None
+            origin = self.origin_of(conn)
+            if origin is None:
+                origin = next(_origins)
+                self.subscribers.append((user, conn, origin))
+            return self.buffer.getvalue(), self.revision, origin
+
+    def origin_of(self, conn):
+        """
+        Return the origin of a subscribed connection; called with the lock held.
+
+        :param conn: The connection
+        :type conn: ssl.SSLSocket
+
+        :return: The origin, or None if the connection is not subscribed
+        :rtype: int or None
+        """
+        for _, subscriber, origin in self.subscribers:
+            if subscriber is conn:
+                return origin
+        return None
+
+    def unsubscribe(self, conn) -> bool:
+        """
+        Remove a connection from the subscribers.
+
+        :param conn: The connection to remove
+        :type conn: ssl.SSLSocket
+
+        :return: True if the document has no subscribers left
+        :rtype: bool
+        """
+        with self.lock:
+            self.subscribers = [subscriber for subscriber in self.subscribers if subscriber[1] is not conn]
+            return not self.subscribers
+
+    def take_pending(self):
+        """
+        Detach the queued batches together with a snapshot of the subscribers to send them to.
+
+        :return: Tuple of (file, batches of [revision, origin, operations], subscribers)
+        :rtype: tuple[File, list[list], list[tuple[User, ssl.SSLSocket]]]
+        """
+        with self.lock:
+            batches = self.pending
+            self.pending = []
+            self.pending_ops = 0
+            return self.file, batches, [(user, conn) for user, conn, _ in self.subscribers]
+
+    def restore_pending(self, batches):
+        """
+        Put batches that could not be broadcast back in front of the queued ones.
+
+        :param batches: Batches of [revision, origin, operations] returned by take_pending
+        :type batches: list[list]
+
+        :return: None
+        """
+        with self.lock:
+            self.pending = batches + self.pending
+            self.pending_ops += sum(len(changes) for _, _, changes in batches)
+
+    def get_content(self) -> str:
+        """
+        Return the current content.
+
+        :return: The current content
+        :rtype: str
+        """
+        with self.lock:
+            return self.buffer.getvalue()
+
+
+class DocumentStore:
+    """
+    Registry of live documents keyed by file id. Content is loaded once on first open, edits are
+    applied in memory and the operations of dirty documents are appended to their journal
+    periodically, when the last client closes them and on shutdown. A journal that grows past
+    COMPACT_THRESHOLD is rolled into a new snapshot by the flush thread, never on the broadcast path.
+
+    The registry lock only guards the dictionary and is never held while a document is used;
+    the lock order is registry lock, then document lock.
+    """
+    def __init__(self, database, flush_interval=FLUSH_INTERVAL, durability=DURABILITY):
+        """
+        Initialize an empty store.
+
+        :param database: The database used to load and save file content
+        :type database: Database
+        :param flush_interval: Seconds between write-behind flushes
+        :type flush_interval: float
+        :param durability: When applied operations reach the journal: DURABILITY_OP, DURABILITY_GROUP or DURABILITY_INTERVAL
+        :type durability: str
+        """
+        assert durability in (DURABILITY_OP, DURABILITY_GROUP, DURABILITY_INTERVAL)
+        self.database = database
+        self.flush_interval = flush_interval
+        self.durability = durability
+        self.documents = {}
+        self.revisions = {}  # last revision of documents dropped from memory, so reloads continue from it
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.wakeup = threading.Event()
+        self.flush_thread = None
+
+    def start(self):
+        """
+        Start the background thread that flushes dirty documents every flush_interval seconds
+        and compacts journals that outgrew COMPACT_THRESHOLD.
+
+        :return: None
+        """
+        self.flush_thread = threading.Thread(target=self.flush_loop, daemon=True)
+        self.flush_thread.start()
+
+    def flush_loop(self):
+        """
+        Flush all documents until the store is shut down; a journal that needs compacting wakes
+        the thread early.
+
+        :return: None
+        """
+        while True:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            if self.stopped.is_set():
+                return
+            self.flush_all()
+            self.compact_all()
+
+    def get(self, file_id: str):
+        """
+        Return the live document for a file if it is loaded.
+
+        :param file_id: The id of the file
+        :type file_id: str
+
+        :return: The live document or None
+        :rtype: LiveDocument or None
+        """
+        with self.lock:
+            return self.documents.get(file_id)
+
+    def open(self, user: User, file: File, conn):
+        """
+        Subscribe a reader's connection to a file and return its content, loading it into memory on first use.
+
+        :param user: The user opening the file
+        :type user: User
+        :param file: The file to open
+        :type file: File
+        :param conn: The connection that receives updates of the file
+        :type conn: ssl.SSLSocket
+
+        :return: Tuple of (content, revision, origin); the content is None if the user cannot read the file
+        :rtype: tuple[str or None, int, int or None]
+        """
+        while True:
+            doc = self.get(file.file_id)
+            if doc is None:
+                doc = self.load(user, file)
+                if doc is None:
+                    return None, 0, None
+            elif not self.database.can_user_read(user, file):
+                return None, 0, None
+
+            snapshot = doc.subscribe(user, conn)
+            if snapshot is not None:
+                return snapshot
+            # The document was closed between the lookup and the subscription; load it again
+
+    def load(self, user: User, file: File):
+        """
+        Load a file from disk into the registry unless another thread already did.
+
+        :param user: The user the content is read for
+        :type user: User
+        :param file: The file to load
+        :type file: File
+
+        :return: The live document, or None if the user cannot read the file or it no longer exists
+        :rtype: LiveDocument or None
+        """
+        content = self.database.get_file_content(user, file)
+        if content is None:
+            return None
+
+        doc = LiveDocument(file, content, self.revisions.get(file.file_id, 0))
+        with self.lock:
+            return self.documents.setdefault(file.file_id, doc)
+
+    def apply(self, user: User, file: File, changes, conn, base_revision=None):
+        """
+        Apply a batch of operations to a file's live document and queue them for broadcast.
+
+        :param user: The user who made the changes (already checked for write access)
+        :type user: User
+        :param file: The file being edited
+        :type file: File
+        :param changes: The operations to apply
+        :type changes: list[Operation]
+        :param conn: The connection the changes came from
+        :type conn: ssl.SSLSocket
+        :param base_revision: The revision the changes were made on, None for the current one
+        :type base_revision: int or None
+
+        :return: The document the changes were applied to, or None if the file could not be loaded
+        :rtype: LiveDocument or None
+        :raises StaleRevisionError: If the base revision is older than the kept history or the connection did not open the file
+        """
+        while True:
+            doc = self.get(file.file_id) or self.load(user, file)
+            if doc is None:
+                return None
+            if doc.apply(file, changes, base_revision, conn) is not None:
+                if self.durability == DURABILITY_OP:
+                    self.flush(doc)
+                return doc
+
+    def commit(self, doc: LiveDocument):
+        """
+        Make the operations applied to a document durable before they are broadcast, which is what
+        acknowledges them to their authors. Does nothing in interval mode.
+
+        :param doc: The document about to be broadcast
+        :type doc: LiveDocument
+
+        :return: False if the operations could not be written and must not be broadcast yet
+        :rtype: bool
+        """
+        if self.durability == DURABILITY_INTERVAL:
+            return True
+        return self.flush(doc)
+
+    def all(self):
+        """
+        Return a snapshot of the loaded documents.
+
+        :return: The live documents
+        :rtype: list[LiveDocument]
+        """
+        with self.lock:
+            return list(self.documents.values())
+
+    def unsubscribe(self, conn):
+        """
+        Remove a connection from every document, closing documents nobody has open anymore.
+
+        :param conn: The connection to remove
+        :type conn: ssl.SSLSocket
+
+        :return: None
+        """
+        for doc in self.all():
+            if doc.unsubscribe(conn):
+                self.close(doc.file_id)
+
+    def flush(self, doc: LiveDocument):
+        """
+        Append the operations applied to a document since the last flush to its journal.
+        Operations that could not be written stay queued for the next flush; a document whose
+        file was deleted is discarded instead, since its operations can never be written.
+
+        :param doc: The document to flush
+        :type doc: LiveDocument
+
+        :return: True if every operation applied so far is on disk
+        :rtype: bool
+        """
+        with doc.flush_lock:
+            with doc.lock:
+                if doc.closed:
+                    return False
+                if not doc.dirty:
+                    return True
+                changes = doc.unsaved
+                doc.unsaved = []
+                doc.dirty = False
+
+            try:
+                size = self.database.append_file_changes(doc.file_id, changes)
+            except FileNotFoundError:
+                logging.warning(f"Document {doc.file_id} was deleted, dropping {len(changes)} unsaved operations")
+                self.discard(doc.file_id)
+                return False
+            if size is None:
+                logging.error(f"Failed to flush document {doc.file_id}")
+                self.requeue(doc, changes)
+                return False
+            if size >= COMPACT_THRESHOLD:
+                with doc.lock:
+                    doc.compaction_due = True
+                self.wakeup.set()
+            return True
+
+    def compact(self, doc: LiveDocument):
+        """
+        Roll a document's journal into a new snapshot of its current content. Only this
+        document's flushes wait for it.
+
+        :param doc: The document to compact
+        :type doc: LiveDocument
+
+        :return: None
+        """
+        with doc.flush_lock:
+            with doc.lock:
+                if doc.closed or not doc.compaction_due:
+                    return
+                content = doc.buffer.getvalue()
+                changes = doc.unsaved
+                doc.unsaved = []
+                doc.dirty = False
+                doc.compaction_due = False
+
+            if not self.database.save_file_content(doc.file_id, content):
+                logging.error(f"Failed to write snapshot of document {doc.file_id}")
+                self.requeue(doc, changes)
+                with doc.lock:
+                    doc.compaction_due = True
+
+    def compact_all(self):
+        """
+        Compact every document whose journal outgrew COMPACT_THRESHOLD.
+
+        :return: None
+        """
+        for doc in self.all():
+            try:
+                self.compact(doc)
+            except Exception as e:
+                logging.error(f"Error compacting document {doc.file_id}: {e}")
+
+    def requeue(self, doc: LiveDocument, changes):
+        """
+        Put operations that could not be written back in front of the document's unsaved ones.
+
+        :param doc: The document
+        :type doc: LiveDocument
+        :param changes: The operations that failed to be written
+        :type changes: list[Operation]
+
+        :return: None
+        """
+        with doc.lock:
+            doc.unsaved = changes + doc.unsaved
+            doc.dirty = True
+
+    def flush_all(self):
+        """
+        Flush every dirty document.
+
+        :return: None
+        """
+        for doc in self.all():
+            try:
+                self.flush(doc)
+            except Exception as e:
+                logging.error(f"Error flushing document {doc.file_id}: {e}")
+
+    def close(self, file_id: str):
+        """
+        Flush a document and drop it from memory, called when its last client closes it.
+
+        :param file_id: The id of the file
+        :type file_id: str
+
+        :return: None
+        """
+        doc = self.get(file_id)
+        if doc is None:
+            return
+
+        self.flush(doc)
+        self.compact(doc)
+        with self.lock, doc.lock:
+            # Keep documents that were edited or opened again while flushing
+            if not doc.dirty and not doc.subscribers and self.documents.get(file_id) is doc:
+                doc.closed = True
+                del self.documents[file_id]
+                self.revisions[file_id] = doc.revision
+
+    def discard(self, file_id: str):
+        """
+        Drop a document from memory without writing it, used when the file is deleted. Its
+        pending and unsaved operations are dropped with it.
+
+        :param file_id: The id of the file
+        :type file_id: str
+
+        :return: None
+        """
+        with self.lock:
+            self.revisions.pop(file_id, None)
+            doc = self.documents.pop(file_id, None)
+            if doc is not None:
+                with doc.lock:
+                    doc.closed = True
+                    doc.pending = []
+                    doc.pending_ops = 0
+                    doc.unsaved = []
+                    doc.dirty = False
+
+    def shutdown(self):
+        """
+        Stop the flush thread and write every dirty document to disk.
+
+        :return: None
+        """
+        self.stopped.set()
+        self.wakeup.set()
+        self.flush_all()
@@ -3,11 +3,17 @@ import customtkinter as ctk
 import tkinter as tk
 
 from operation import Operation
+from operation_compactor import OperationCompactor
+from ot import transform_lists
 from request import Request
+from text_buffer import TextBuffer
+from text_proxy import TextProxy
+
+VIEW_MARK = 'coedit_view'  # mark that follows the first visible character while remote changes are applied
 
 
 class FileEditor(ctk.CTkToplevel):
-    def __init__(self, client, file, my_user, content):
+    def __init__(self, client, file, my_user, content, revision=0, origin=None):
         """
         Initialize the FileEditor window.
 
@@ -19,6 +25,10 @@ class FileEditor(ctk.CTkToplevel):
         :type my_user: str
         :param content: Initial content of the file
         :type content: str
+        :param revision: Server revision the initial content is at
+        :type revision: int
+        :param origin: Id the server tags this editor's batches with
+        :type origin: int
         """
         super().__init__()
         self.title("CoEdit")
@@ -54,12 +64,19 @@ class FileEditor(ctk.CTkToplevel):
         self.text_area._textbox.config(undo=True, maxundo=-1)
         self.text_area.bind("<<Modified>>", self.on_text_change)
 
-        self.changes_history = []
+        self.revision = revision
+        self.origin = origin
+        self.outstanding = None  # ops sent to the server and not yet acknowledged
+        self.unsent = []  # local ops made while waiting for the acknowledgement
+        self.compactor = OperationCompactor()
+        self.no_access_box = None
         self.undo_stack = []  # type: list[Operation]
         self.redo_stack = []  # type: list[Operation]
 
-        self.current_content = content
-        self.text_area.insert("1.0", self.current_content)
+        self.content = TextBuffer(content)  # mirror of the text area, kept up to date by the proxy
+        self.text_area.insert("1.0", content)
+        # Every insert and delete on the widget is reported to on_widget_edit from here on
+        self.text_proxy = TextProxy(self.text_area._textbox, self.on_widget_edit)
 
         # Menu
         self.menu = tk.Menu(self)
@@ -157,8 +174,6 @@ class FileEditor(ctk.CTkToplevel):
             op = self.undo_stack.pop()
             self.revert_change(op)
             self.redo_stack.append(op)
-            self.changes_history.remove(op)
-            self.current_content = self.text_area.get("1.0", "end-1c")
         finally:
             self.suppress_text_change = False
 
@@ -179,19 +194,16 @@ class FileEditor(ctk.CTkToplevel):
             op = self.redo_stack.pop()
             self.apply_single_change(op)
             self.undo_stack.append(op)
-            self.changes_history.append(op)
-            self.changes_history.sort()
-            self.current_content = self.text_area.get("1.0", "end-1c")
         finally:
             self.suppress_text_change = False
 
-    def on_text_change(self, event):
+    def on_text_change(self, event=None):
         """
-        Handle text changes in the text area, compute diffs, update history,
-        and send update to the server.
+        Handle text changes in the text area: the edits were already captured by the text proxy,
+        so only send them to the server.
 
         :param event: Event triggered when text is modified
-        :type event: Event
+        :type event: Event or None
 
         :return: None
         """
@@ -199,24 +211,73 @@ class FileEditor(ctk.CTkToplevel):
             return
 
         self.text_area.edit_modified(False)
-        new_content = self.text_area.get("1.0", "end-1c")
+        self.capture_local_changes()
+        self.send_pending()
+
+    def on_widget_edit(self, op: Operation):
+        """
+        Called by the text proxy after every insert or delete on the text area. Keeps the content
+        mirror in step and queues local edits for sending, in O(log n) per edit.
+
+        :param op: The edit, positioned in the document as it was right before it
+        :type op: Operation
+
+        :return: None
+        """
+        op.apply_to(self.content)
 
-        if new_content == self.current_content:
+        # Remote changes, undo and redo are applied with suppress_text_change set
+        if self.suppress_text_change:
             return
 
-        diff_ops = self.get_diff_changes(self.current_content, new_content)
+        self.redo_stack.clear()
+        self.unsent.append(op)
+
+    def capture_local_changes(self):
+        """
+        Fallback for edits the text proxy could not describe: turn the difference between the
+        text area and the content mirror into operations queued for sending.
+
+        :return: None
+        """
+        if not self.text_proxy.untracked:
+            return
+        self.text_proxy.untracked = False
+
+        new_content = self.text_area.get("1.0", "end-1c")
+        old_content = self.content.getvalue()
+        if new_content == old_content:
+            return
+
+        # Advances the content mirror to new_content
+        diff_ops = self.get_diff_changes(old_content, new_content)
 
-        for op in diff_ops:
-            self.changes_history.append(op)
         self.redo_stack.clear()
+        self.unsent.extend(diff_ops)
 
-        self.current_content = new_content
+    def send_pending(self):
+        """
+        Send the queued local operations unless an earlier batch is still waiting for its acknowledgement.
+        The batch names the revision it was made on, so the server can transform it against concurrent edits.
 
-        self.client.send_request(Request('file-content-update', [self.current_file, diff_ops, self.my_user]))
+        :return: None
+        """
+        if self.outstanding is not None or not self.unsent:
+            return
+
+        changes = self.compactor.compact(self.unsent)
+        self.unsent = []
+        if not changes:
+            return
+
+        self.outstanding = changes
+        self.client.send_request(Request('file-content-update', [self.current_file, changes, self.my_user, self.revision]))
 
     def get_diff_changes(self, old: str, new: str) -> list[Operation]:
         """
             Compute a list of Operation objects representing the difference between old and new content.
+            Each operation is positioned in the document as it is after the previous operations,
+            and is applied to self.content, which is advanced from old to new along the way.
 
             :param old: The old version of the text
             :type old: str
@@ -233,19 +294,15 @@ class FileEditor(ctk.CTkToplevel):
             if tag == 'equal':
                 continue
 
-            old_sub = old[i1:i2]
-            new_sub = new[j1:j2]
+            # Everything before j1 already matches the new text
+            line, char = self.content.position_of(j1)
 
-            line = old[:i1].count('\n')
-            char = i1 - old.rfind('\n', 0, i1) - 1 if '\n' in old[:i1] else i1
-
-            if tag == 'insert':
-                changes.append(Operation("insert", new_sub, line, char))
-            elif tag == 'delete':
-                changes.append(Operation("delete", old_sub, line, char))
-            elif tag == 'replace':
-                changes.append(Operation("delete", old_sub, line, char))
-                changes.append(Operation("insert", new_sub, line, char))
+            if tag in ('delete', 'replace'):
+                changes.append(Operation("delete", old[i1:i2], line, char))
+                changes[-1].apply_to(self.content)
+            if tag in ('insert', 'replace'):
+                changes.append(Operation("insert", new[j1:j2], line, char))
+                changes[-1].apply_to(self.content)
 
         return changes
 
@@ -275,12 +332,43 @@ class FileEditor(ctk.CTkToplevel):
         elif op.op_type == "insert":
             self.text_area.insert(index, op.text)
 
+    def receive_batches(self, batches):
+        """
+        Process revision batches broadcast by the server. Our own batch acknowledges the outstanding
+        operations; batches of other editors, including the same user's in another window, are
+        applied. Revisions already included are skipped. Consecutive batches of other editors are
+        applied together in one apply_changes call.
+
+        :param batches: Batches of [revision, origin, operations] in revision order
+        :type batches: list[list]
+
+        :return: None
+        """
+        remote = []
+        for revision, origin, changes in batches:
+            if revision <= self.revision:
+                continue
+            if origin == self.origin:
+                # Batches after our own were already transformed by the server to follow it
+                if remote:
+                    self.apply_changes(remote)
+                    remote = []
+                self.outstanding = None
+            else:
+                remote.extend(changes)
+            self.revision = revision
+
+        if remote:
+            self.apply_changes(remote)
+        self.send_pending()
+
     def apply_changes(self, changes):
         """
-        Apply a list of changes with operational transformation,
-        maintaining the order and consistency of the document.
+        Apply remote changes with operational transformation: they are transformed against the
+        local operations the server has not applied yet, and those against them, so each remote
+        operation is applied once without reverting local history.
 
-        :param changes: A list of Operation objects to apply
+        :param changes: A list of Operation objects to apply, in server order
         :type changes: list[Operation]
 
         :return: None
@@ -288,26 +376,94 @@ class FileEditor(ctk.CTkToplevel):
         self.suppress_text_change = True
 
         try:
-            for change in changes:
-                future_changes = [c for c in self.changes_history if c.timestamp > change.timestamp]
+            # Edits the text proxy could not describe must be part of the local operations first
+            self.capture_local_changes()
+            if self.outstanding:
+                changes, self.outstanding = transform_lists(changes, self.outstanding, True)
+            if self.unsent:
+                changes, self.unsent = transform_lists(changes, self.unsent, True)
+
+            self.apply_batch(changes)
+
+            self.text_area.edit_modified(False)
+
+        finally:
+            self.suppress_text_change = False
+
+    def apply_batch(self, changes):
+        """
+        Apply a list of operations to the text area in one pass, keeping the local view in place.
+
+        Each operation becomes a Tk index pair ("line.char" and "+Nc") without splitting its text.
+        Tk redraws at idle time, so the whole batch is displayed in a single redraw. The insert
+        cursor and the selection are marks and tags, which Tk moves along with the edits; the
+        scroll position is pinned to a mark on the first visible character and restored at the end.
+        The content mirror is updated by the text proxy as each edit is made.
+
+        :param changes: Operations applied one after another
+        :type changes: list[Operation]
+
+        :return: None
+        """
+        if not changes:
+            return
 
-                for fc in reversed(future_changes):
-                    self.revert_change(fc)
+        widget = self.text_area._textbox
+        widget.mark_set(VIEW_MARK, "@0,0")
+        widget.mark_gravity(VIEW_MARK, "left")
+        left = widget.xview()[0]
 
-                self.apply_single_change(change)
+        for op in changes:
+            index = f"{op.line + 1}.{op.char}"
+            if op.op_type == "insert":
+                widget.insert(index, op.text)
+            else:
+                widget.delete(index, f"{index}+{len(op.text)}c")
 
-                self.changes_history.append(change)
-                self.changes_history.sort()
+        widget.yview(VIEW_MARK)
+        widget.xview_moveto(left)
+        widget.mark_unset(VIEW_MARK)
 
-                for fc in future_changes:
-                    self.apply_single_change(fc)
+    def resync(self, content: str, revision: int, origin=None):
+        """
+        Replace the content with the server's after falling too far behind or reconnecting; unacknowledged local edits are dropped.
 
-            self.current_content = self.text_area.get("1.0", "end-1c")
+        :param content: The current content on the server
+        :type content: str
+        :param revision: Server revision the content is at
+        :type revision: int
+        :param origin: Id the server tags this editor's batches with from now on
+        :type origin: int
+
+        :return: None
+        """
+        self.suppress_text_change = True
+
+        try:
+            self.text_area.delete("1.0", "end")
+            self.text_area.insert("1.0", content)
+            self.content = TextBuffer(content)
+            self.revision = revision
+            self.origin = origin
+            self.outstanding = None
+            self.unsent = []
+            self.undo_stack.clear()
+            self.redo_stack.clear()
             self.text_area.edit_modified(False)
 
         finally:
             self.suppress_text_change = False
 
+    def drop_local_changes(self):
+        """
+        Forget the local operations the server refused, so later remote batches are not transformed
+        against them; the text keeps showing them until resync replaces it with the server's content.
+
+        :return: None
+        """
+        self.outstanding = None
+        self.unsent = []
+
     def revert_change(self, op: Operation):
         """
         Revert a given Operation to undo its effect in the text area.
@@ -338,6 +494,8 @@ class FileEditor(ctk.CTkToplevel):
         """
         Display a message box notifying the user that they do not have write access.
         """
+        if self.no_access_box is not None:
+            return
         self.no_access_box = ctk.CTkTextbox(self, height=30)
         self.no_access_box.insert("1.0", "You do not have write access to this file.")
         self.no_access_box.configure(state="disabled")
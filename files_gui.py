@@ -11,6 +11,7 @@ from file_editor import FileEditor
 from request import Request
 from user import User
 from user_access import UserAccess
+from virtual_file_list import VirtualFileList
 
 ctk.set_appearance_mode("light")
 ctk.set_default_color_theme("blue")
@@ -26,12 +27,14 @@ class FileManagerApp(ctk.CTk):
         """
         super().__init__()
         self.open_editors = {}
+        self.reopening = set()  # ids of open files requested again after a reconnection or a refused edit
         self.container = gui_manager.container
         self.client = gui_manager.client
 
         self.files_frame = ctk.CTkFrame(self.container)
 
         self.filtered_files = []
+        self.pending_rename = None  # (file, new name) until the server answers
 
         self.my_user = None
 
@@ -74,23 +77,22 @@ class FileManagerApp(ctk.CTk):
 
     def display_files(self):
         """
-        Displays the filtered files in the UI.
+        Displays the filtered files in the UI; only the rows in view are drawn.
 
         :return: None
         """
-        for widget in self.file_frame.winfo_children():
-            widget.destroy()
+        self.file_frame.set_files(self.filtered_files)
 
-        for i, file in enumerate(self.filtered_files):
-            action_btn = ctk.CTkButton(self.file_frame, text="⋮", width=30, command=lambda f=file: self.show_actions(f))
-            action_btn.grid(row=i, column=0, padx=5, pady=5)
+    def open_file_request(self, file):
+        """
+        Asks the server to open a file that was double-clicked in the list.
 
-            name_label = ctk.CTkLabel(self.file_frame, text=file.filename, anchor="w", width=200)
-            name_label.grid(row=i, column=1, sticky="w")
-            name_label.bind("<Double-Button-1>", lambda e, f=file: self.client.send_request(Request("open-file", [self.my_user, f])))
+        :param file: The file to open.
+        :type file: File
 
-            ctk.CTkLabel(self.file_frame, text=file.owner.username, width=100).grid(row=i, column=2)
-            ctk.CTkLabel(self.file_frame, text=file.creation_date, width=150).grid(row=i, column=3)
+        :return: None
+        """
+        self.client.send_request(Request("open-file", [self.my_user, file]))
 
     def create_widgets(self):
         """
@@ -138,7 +140,7 @@ class FileManagerApp(ctk.CTk):
         ctk.CTkLabel(header_frame, text="Owner", width=100).grid(row=0, column=2)
         ctk.CTkLabel(header_frame, text="Date Modified", width=150).grid(row=0, column=3)
 
-        self.file_frame = ctk.CTkScrollableFrame(self.files_frame)
+        self.file_frame = VirtualFileList(self.files_frame, on_open=self.open_file_request, on_actions=self.show_actions)
         self.file_frame.pack(fill="both", expand=True, padx=20, pady=10)
 
         self.display_files()
@@ -202,6 +204,7 @@ class FileManagerApp(ctk.CTk):
         """
         new_name = simpledialog.askstring("Rename File", "Enter new name:", initialvalue=file.filename)
         if new_name:
+            self.pending_rename = (file, new_name)
             self.client.send_request(Request("rename-file", [file, new_name]))
 
     def rename_file_success(self, success_rename: bool):
@@ -213,11 +216,16 @@ class FileManagerApp(ctk.CTk):
 
         :return: None
         """
+        if success_rename and self.pending_rename:
+            file, new_name = self.pending_rename
+            file.filename = new_name
+            self.file_frame.refresh(file)
+        self.pending_rename = None
+
         if success_rename:
             messagebox.showinfo("rename", 'rename was successful')
         else:
             messagebox.showerror("rename", 'rename was unsuccessful')
-        self.search_files()
 
     def delete_file(self, file):
         """
@@ -231,15 +239,13 @@ class FileManagerApp(ctk.CTk):
         confirm = messagebox.askyesno("Confirm Delete", f"Are you sure you want to delete '{file.filename}'?")
         if confirm:
             self.client.send_request(Request("delete-file", [file, self.my_user]))
-            self.file_list.remove(file)
-            self.search_files()
+            self.forget_file(file)
 
     def delete_file_success(self, success: bool):
         if success:
             messagebox.showinfo("delete", 'delete was successful')
         else:
             messagebox.showerror("delete", 'delete was unsuccessful')
-        self.search_files()
 
     def delete_file_for_me(self, file):
         """
@@ -253,8 +259,21 @@ class FileManagerApp(ctk.CTk):
         confirm = messagebox.askyesno("Confirm", f"Remove access to '{file.filename}' just for you?")
         if confirm:
             self.client.send_request(Request("delete-file-for-me", [file, self.my_user]))
-            self.file_list.remove(file)
-            self.search_files()
+            self.forget_file(file)
+
+    def forget_file(self, file):
+        """
+        Removes a file from the lists and from the view, without redrawing the other rows.
+
+        :param file: The file to remove.
+        :type file: File
+
+        :return: None
+        """
+        self.file_list.remove(file)
+        if file in self.filtered_files:
+            self.filtered_files.remove(file)
+        self.file_frame.remove(file)
 
     def sync_read_write(self, read_var, write_var):
         """
@@ -419,7 +438,7 @@ class FileManagerApp(ctk.CTk):
         self.add_user_btn.grid(row=starting_row, column=1, padx=10, pady=10)
         self.save_btn.grid(row=starting_row + 1, columnspan=3, pady=15)
 
-    def open_file(self, file: File, content: str):
+    def open_file(self, file: File, content: str, revision: int = 0, origin=None):
         """
         Opens the file in an editor window if content is available.
 
@@ -429,36 +448,97 @@ class FileManagerApp(ctk.CTk):
         :param content: File content to load in editor.
         :type content: str
 
+        :param revision: Server revision the content is at.
+        :type revision: int
+
+        :param origin: Id the server tags the editor's batches with.
+        :type origin: int
+
         :return: None
         """
+        editor = self.open_editors.get(file.file_id)
+        if file.file_id in self.reopening and editor:
+            # Reopened after a reconnection: continue in the same window from the server's content
+            self.reopening.discard(file.file_id)
+            if content is not None:
+                editor.resync(content, revision, origin)
+            return
+
         if content is not None:
-            editor_window = FileEditor(self.client, file, self.my_user, content)
+            editor_window = FileEditor(self.client, file, self.my_user, content, revision, origin)
             editor_window.title(file.filename)
             self.open_editors[file.file_id] = editor_window
         else:
             messagebox.showinfo("no permission", "You don't have permissions for this file.")
 
-    def apply_file_update(self, file: File, changes: list[dict]):
+    def reopen_editors(self):
+        """
+        Asks the server to open the files of the editor windows again after a reconnection;
+        each window then continues from the content the server sends back.
+
+        :return: None
         """
-        Applies incoming changes to an open file editor.
+        for file_id, editor in list(self.open_editors.items()):
+            if not editor.winfo_exists():
+                del self.open_editors[file_id]
+                continue
+            self.request_resync(editor)
+
+    def request_resync(self, editor):
+        """
+        Asks the server to open an editor's file again; the window continues from the content
+        the server sends back.
+
+        :param editor: The editor window to resync.
+        :type editor: FileEditor
+
+        :return: None
+        """
+        self.reopening.add(editor.current_file.file_id)
+        self.client.send_request(Request("open-file", [self.my_user, editor.current_file]))
+
+    def apply_file_update(self, file: File, batches: list):
+        """
+        Applies incoming revision batches to an open file editor.
 
         :param file: File object being edited.
         :type file: File
 
-        :param changes: List of changes to apply.
-        :type changes: list[dict]
+        :param batches: Batches of [revision, origin, operations] in revision order.
+        :type batches: list[list]
 
         :return: None
         """
         editor = self.open_editors.get(file.file_id)
         if editor:
-            editor.apply_changes(changes)
+            editor.receive_batches(batches)
 
+    def resync_file(self, file: File, content: str, revision: int, origin=None):
+        """
+        Replaces the content of an open editor that fell too far behind the server.
 
+        :param file: File object being edited.
+        :type file: File
+
+        :param content: The current content on the server.
+        :type content: str
+
+        :param revision: Server revision the content is at.
+        :type revision: int
+
+        :param origin: Id the server tags the editor's batches with.
+        :type origin: int
+
+        :return: None
+        """
+        editor = self.open_editors.get(file.file_id)
+        if editor and content is not None:
+            editor.resync(content, revision, origin)
 
     def write_access_response(self, file: File, write_access):
         """
-        Handles server response indicating write access status.
+        Handles server response indicating write access status. A denied batch was never
+        applied by the server, so the editor drops its unacknowledged edits and is resynced.
 
         :param file: File object for which access is being checked.
         :type file: File
@@ -469,10 +549,14 @@ class FileManagerApp(ctk.CTk):
         :return: None
         """
         editor = self.open_editors.get(file.file_id)
-        if editor and write_access:
+        if not editor:
+            return
+        if write_access:
             editor.on_text_change()
-        elif not write_access:
+        else:
             editor.show_no_write_access_message()
+            editor.drop_local_changes()
+            self.request_resync(editor)
 
     def add_file(self):
         """
@@ -508,10 +592,12 @@ class FileManagerApp(ctk.CTk):
         """
         if success:
             self.file_list.append(new_file)
+            if self.search_entry.get().lower() in new_file.filename.lower():
+                self.filtered_files.append(new_file)
+                self.file_frame.append(new_file)
             messagebox.showinfo("File Added", f"New file '{new_file.filename}' created successfully.")
         else:
-            messagebox.showinfo("File Added", f"New file '{new_file.filename}' failed to be created.")
-        self.search_files()
+            messagebox.showinfo("File Added", "New file failed to be created.")
 
     def logout(self):
         """
@@ -528,6 +614,7 @@ class FileManagerApp(ctk.CTk):
         self.file_list = []
         self.filtered_files = []
         self.open_editors = {}
+        self.reopening.clear()
 
         # clear file display
         for widget in self.file_frame.winfo_children():
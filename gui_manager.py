@@ -1,3 +1,6 @@
+import time
+import tkinter
+
 import customtkinter as ctk
 
 from files_gui import FileManagerApp
@@ -9,6 +12,9 @@ from client import Client
 import logging
 logging.basicConfig(filename='client_loggs.log', level=logging.DEBUG)
 
+POLL_INTERVAL = 100  # ms between fallback queue checks, in case a wake-up event was missed
+DISPATCH_BUDGET = 0.05  # seconds of responses handled per cycle before yielding to redraws and input
+
 ctk.set_appearance_mode("light")
 ctk.set_default_color_theme("blue")
 
@@ -39,6 +45,9 @@ class GuiManager(ctk.CTk):
         self.protocol("WM_DELETE_WINDOW", self.on_closing)
 
         self.client = Client()
+        self.wake_pending = False
+        self.bind('<<ServerResponse>>', self.on_server_response)
+        self.client.on_response = self.wake
         self.client.connect()
 
         self.login_gui = LoginGui(self)
@@ -54,12 +63,74 @@ class GuiManager(ctk.CTk):
 
     def poll_client_response(self):
         """
-        Handles server responses and updates the application state accordingly.
+        Fallback check of the client's queue; responses are normally handled as soon as they arrive.
+        """
+        self.dispatch_responses()
+        self.after(POLL_INTERVAL, self.poll_client_response)
+
+    def wake(self):
+        """
+        Called on the client's listen thread when a response was queued: schedule dispatching it
+        on the Tk thread. One wake-up is enough for any number of queued responses.
+        """
+        if self.wake_pending:
+            return
+        self.wake_pending = True
+        try:
+            self.event_generate('<<ServerResponse>>', when='tail')
+        except (RuntimeError, tkinter.TclError):
+            # The main loop is not running (yet); the fallback poll picks the response up
+            self.wake_pending = False
+
+    def on_server_response(self, event=None):
+        """
+        Handles the wake-up event generated by the listen thread.
         """
-        response = self.client.get_response_nowait()
-        if response:
-            self.handle_response_change_state(response)
-        self.after(100, self.poll_client_response)
+        self.wake_pending = False
+        self.dispatch_responses()
+
+    def dispatch_responses(self):
+        """
+        Handles queued server responses until the queue is empty or DISPATCH_BUDGET is used up,
+        in which case the rest is handled once pending redraws and input were processed.
+        Consecutive content updates of the same file are merged and applied together.
+        """
+        deadline = time.monotonic() + DISPATCH_BUDGET
+        pending = None
+        while time.monotonic() < deadline:
+            response = self.client.get_response_nowait()
+            if response is None:
+                break
+            if pending and self.merge_updates(pending, response):
+                continue
+            if pending:
+                self.handle_response_change_state(pending)
+            pending = response
+        else:
+            self.after_idle(self.dispatch_responses)
+
+        if pending:
+            self.handle_response_change_state(pending)
+
+    @staticmethod
+    def merge_updates(first: Request, second: Request) -> bool:
+        """
+        Fold the batches of a content update into the preceding update of the same file.
+
+        :param first: The earlier response, extended in place
+        :type first: Request
+        :param second: The response that followed it
+        :type second: Request
+
+        :return: True if second was merged into first
+        :rtype: bool
+        """
+        if first.request_type != 'file-content-update' or second.request_type != 'file-content-update':
+            return False
+        if first.data[0].file_id != second.data[0].file_id:
+            return False
+        first.data = [first.data[0], list(first.data[1]) + list(second.data[1])]
+        return True
 
     def handle_response_change_state(self, response: Request):
         """
@@ -75,8 +146,20 @@ class GuiManager(ctk.CTk):
             self.show_login_page()
         elif response.request_type == 'login-success' and response.data[0]:
             self.my_user = response.data[1]
+            self.client.session_token = response.data[2]
             self.files_gui.initialize_user_interface(self.my_user)
             self.show_files_page()
+        elif response.request_type == 'resume-session-response':
+            resumed, user = response.data
+            if resumed:
+                self.my_user = user
+                # The server forgot the documents of the lost connection: open them again
+                self.files_gui.reopen_editors()
+            else:
+                # The session expired while disconnected: log in again
+                self.client.session_token = None
+                self.my_user = None
+                self.return_to_login_page()
         elif response.request_type == 'add-file-success':
             if not response.data[0]:
                 self.files_gui.add_file_refresh(False, None)
@@ -93,10 +176,12 @@ class GuiManager(ctk.CTk):
         elif response.request_type == 'file-list': # refresh files button
             self.files_gui.refresh_files(response.data)
         elif response.request_type == 'file-content':
-            self.files_gui.open_file(response.data[0], response.data[1])
+            self.files_gui.open_file(*response.data)
         elif response.request_type == 'file-content-update':
-            file, changes = response.data
-            self.files_gui.apply_file_update(file, changes)
+            file, batches = response.data
+            self.files_gui.apply_file_update(file, batches)
+        elif response.request_type == 'file-resync':
+            self.files_gui.resync_file(*response.data)
         elif response.request_type == 'write-access-response':
             file, write_access = response.data
             self.files_gui.write_access_response(file, write_access)
@@ -105,6 +190,7 @@ class GuiManager(ctk.CTk):
         elif response.request_type == 'logout_success':
             success = response.data
             if success:
+                self.client.session_token = None
                 self.return_to_login_page()
 
     def return_to_login_page(self):
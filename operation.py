@@ -2,7 +2,7 @@ import time
 
 
 class Operation:
-    def __init__(self, op_type, text, line, char, timestamp=None):
+    def __init__(self, op_type, text, line, char, timestamp=None, origin=None):
         """
         Initialize an Operation instance representing an insert or delete text operation.
 
@@ -16,6 +16,8 @@ class Operation:
         :type char: int
         :param timestamp: Optional timestamp for the operation; current time if None
         :type timestamp: float or None
+        :param origin: Subscription id of the connection that made the operation, set by the server
+        :type origin: int or None
         """
         assert op_type in ("insert", "delete")
         self.op_type = op_type
@@ -23,6 +25,7 @@ class Operation:
         self.line = line
         self.char = char
         self.timestamp = timestamp or time.time()
+        self.origin = origin
 
     def apply(self, content: str) -> str:
         """
@@ -51,6 +54,59 @@ class Operation:
 
         return new_text
 
+    def apply_to(self, buffer):
+        """
+        Apply the operation in place to a TextBuffer.
+
+        :param buffer: The buffer holding the document
+        :type buffer: TextBuffer
+
+        :return: None
+        """
+        if self.op_type == 'insert':
+            buffer.insert_at(self.line, self.char, self.text)
+        elif self.op_type == 'delete':
+            buffer.delete_at(self.line, self.char, len(self.text))
+        else:
+            raise ValueError("Unknown operation type")
+
+    def end_position(self):
+        """
+        Return the position right after the operation's text, counted from where the operation starts.
+
+        :return: Tuple of (line, char)
+        :rtype: tuple[int, int]
+        """
+        breaks = self.text.count('\n')
+        if not breaks:
+            return self.line, self.char + len(self.text)
+        return self.line + breaks, len(self.text) - self.text.rindex('\n') - 1
+
+    def offset_within(self, line: int, char: int):
+        """
+        Return the offset of a position inside the operation's text, measured from the operation's start.
+
+        :param line: Zero-based line number of the position
+        :type line: int
+        :param char: Zero-based character of the position
+        :type char: int
+
+        :return: The offset in [0, len(text)], or None if the position is outside the text
+        :rtype: int or None
+        """
+        if line < self.line:
+            return None
+        if line == self.line:
+            offset = char - self.char
+        else:
+            index = -1
+            for _ in range(line - self.line):
+                index = self.text.find('\n', index + 1)
+                if index < 0:
+                    return None
+            offset = index + 1 + char
+        return offset if 0 <= offset <= len(self.text) else None
+
     def __lt__(self, other):
         """
         Compare two Operation instances based on their timestamps.
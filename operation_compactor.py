@@ -0,0 +1,120 @@
+import threading
+
+from operation import Operation
+
+
+def merge(first: Operation, second: Operation):
+    """
+    Combine two consecutive operations of the same author into one.
+
+    :param first: The earlier operation
+    :type first: Operation
+    :param second: The operation applied right after it
+    :type second: Operation
+
+    :return: The merged operation, None if the two cancel out, or False if they cannot be merged
+    :rtype: Operation or None or bool
+    """
+    if first.origin != second.origin:
+        return False
+
+    if first.op_type == 'insert' and second.op_type == 'insert':
+        offset = first.offset_within(second.line, second.char)
+        if offset is None:
+            return False
+        text = first.text[:offset] + second.text + first.text[offset:]
+        return Operation('insert', text, first.line, first.char, second.timestamp, first.origin)
+
+    if first.op_type == 'delete' and second.op_type == 'delete':
+        if (second.line, second.char) == (first.line, first.char):
+            # Forward delete: the second range followed the first one
+            text = first.text + second.text
+            return Operation('delete', text, first.line, first.char, second.timestamp, first.origin)
+        if second.end_position() == (first.line, first.char):
+            # Backspace: the second range preceded the first one
+            text = second.text + first.text
+            return Operation('delete', text, second.line, second.char, second.timestamp, first.origin)
+        return False
+
+    if first.op_type == 'insert' and second.op_type == 'delete':
+        offset = first.offset_within(second.line, second.char)
+        if offset is None or first.text[offset:offset + len(second.text)] != second.text:
+            return False
+        text = first.text[:offset] + first.text[offset + len(second.text):]
+        if not text:
+            return None
+        return Operation('insert', text, first.line, first.char, second.timestamp, first.origin)
+
+    return False
+
+
+class OperationCompactor:
+    """
+    Shrinks a sequence of operations before it is applied, broadcast or stored: adjacent inserts
+    and deletes of the same author are merged into ranges and text that is inserted and then
+    deleted again disappears. Applying the compacted list yields the same document as the input.
+    """
+    def __init__(self):
+        """
+        Initialize the compaction counters.
+        """
+        self.lock = threading.Lock()
+        self.ops_in = 0
+        self.ops_out = 0
+
+    def compact(self, changes):
+        """
+        Compact a list of operations that are applied one after another.
+
+        :param changes: The operations, in application order
+        :type changes: list[Operation]
+
+        :return: The compacted operations
+        :rtype: list[Operation]
+        """
+        result = []
+        for op in changes:
+            merged = merge(result[-1], op) if result else False
+            if merged is False:
+                result.append(op)
+            elif merged is None:
+                result.pop()
+            else:
+                result[-1] = merged
+
+        with self.lock:
+            self.ops_in += len(changes)
+            self.ops_out += len(result)
+        return result
+
+    def compact_batches(self, batches):
+        """
+        Merge consecutive revision batches of the same author into one batch carrying the later revision.
+
+        :param batches: Batches of [revision, origin, operations] in revision order
+        :type batches: list[list]
+
+        :return: The merged batches
+        :rtype: list[list]
+        """
+        result = []
+        for revision, origin, changes in batches:
+            if result and result[-1][1] == origin:
+                result[-1] = [revision, origin, self.compact(result[-1][2] + changes)]
+            else:
+                result.append([revision, origin, changes])
+        return result
+
+    def stats(self) -> dict:
+        """
+        Return the compaction counters.
+
+        :return: Dictionary with ops_in, ops_out and ratio (input ops per output op)
+        :rtype: dict
+        """
+        with self.lock:
+            return {
+                'ops_in': self.ops_in,
+                'ops_out': self.ops_out,
+                'ratio': self.ops_in / self.ops_out if self.ops_out else 0.0,
+            }
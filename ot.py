@@ -0,0 +1,139 @@
+from operation import Operation
+
+
+def shift_after_insert(line: int, char: int, op: Operation):
+    """
+    Move a position that lies at or after an insert's start past the inserted text.
+
+    :param line: Zero-based line number of the position
+    :type line: int
+    :param char: Zero-based character of the position
+    :type char: int
+    :param op: The insert operation
+    :type op: Operation
+
+    :return: Tuple of (line, char)
+    :rtype: tuple[int, int]
+    """
+    if line != op.line:
+        return line + op.text.count('\n'), char
+    end_line, end_char = op.end_position()
+    return end_line, end_char + char - op.char
+
+
+def shift_after_delete(line: int, char: int, op: Operation):
+    """
+    Move a position that lies at or after the end of a deleted range back over the range.
+
+    :param line: Zero-based line number of the position
+    :type line: int
+    :param char: Zero-based character of the position
+    :type char: int
+    :param op: The delete operation
+    :type op: Operation
+
+    :return: Tuple of (line, char)
+    :rtype: tuple[int, int]
+    """
+    end_line, end_char = op.end_position()
+    if line != end_line:
+        return line - op.text.count('\n'), char
+    return op.line, op.char + char - end_char
+
+
+def moved(op: Operation, text: str, position):
+    """
+    Return a copy of an operation with new text and position.
+    """
+    return Operation(op.op_type, text, position[0], position[1], op.timestamp, op.origin)
+
+
+def transform(op: Operation, other: Operation, op_wins: bool):
+    """
+    Transform an operation so it applies after a concurrent operation made on the same document state.
+
+    :param op: The operation to transform
+    :type op: Operation
+    :param other: The concurrent operation that is applied first
+    :type other: Operation
+    :param op_wins: Whether op goes first when both insert at the same position
+    :type op_wins: bool
+
+    :return: The transformed operation, split in two or dropped as needed
+    :rtype: list[Operation]
+    """
+    start = (op.line, op.char)
+    other_start = (other.line, other.char)
+
+    if other.op_type == 'insert':
+        if op.op_type == 'insert':
+            if start < other_start or (start == other_start and op_wins):
+                return [op]
+            return [moved(op, op.text, shift_after_insert(op.line, op.char, other))]
+
+        if start >= other_start:
+            return [moved(op, op.text, shift_after_insert(op.line, op.char, other))]
+        offset = op.offset_within(other.line, other.char)
+        if offset is None or offset == len(op.text):
+            return [op]
+        # The insert landed inside the deleted range: delete around it
+        head = moved(op, op.text[:offset], start)
+        tail = moved(op, op.text[offset:], moved(other, other.text, start).end_position())
+        return [head, tail]
+
+    # other is a delete
+    if op.op_type == 'insert':
+        if start <= other_start:
+            return [op]
+        if other.offset_within(op.line, op.char) is not None:
+            return [moved(op, op.text, other_start)]
+        return [moved(op, op.text, shift_after_delete(op.line, op.char, other))]
+
+    if start <= other_start:
+        offset = op.offset_within(other.line, other.char)
+        if offset is None:
+            return [op]
+        overlap = min(len(op.text) - offset, len(other.text))
+        text = op.text[:offset] + op.text[offset + overlap:]
+        return [moved(op, text, start)] if text else []
+
+    offset = other.offset_within(op.line, op.char)
+    if offset is None:
+        return [moved(op, op.text, shift_after_delete(op.line, op.char, other))]
+    overlap = min(len(other.text) - offset, len(op.text))
+    text = op.text[overlap:]
+    return [moved(op, text, other_start)] if text else []
+
+
+def transform_lists(ops, others, ops_win: bool):
+    """
+    Transform two sequences of operations made concurrently on the same document state against
+    each other, so that ops + others' and others + ops' give the same document.
+
+    :param ops: Operations applied one after another
+    :type ops: list[Operation]
+    :param others: Concurrent operations applied one after another
+    :type others: list[Operation]
+    :param ops_win: Whether ops go first when both sides insert at the same position
+    :type ops_win: bool
+
+    :return: Tuple of (ops transformed to follow others, others transformed to follow ops)
+    :rtype: tuple[list[Operation], list[Operation]]
+    """
+    if not ops or not others:
+        return ops, others
+
+    if len(ops) == 1 and len(others) == 1:
+        return transform(ops[0], others[0], ops_win), transform(others[0], ops[0], not ops_win)
+
+    # Split the longer side in halves so the recursion stays O(log n) deep
+    if len(ops) >= len(others):
+        middle = len(ops) // 2
+        head, others = transform_lists(ops[:middle], others, ops_win)
+        tail, others = transform_lists(ops[middle:], others, ops_win)
+        return head + tail, others
+
+    middle = len(others) // 2
+    ops, head = transform_lists(ops, others[:middle], ops_win)
+    ops, tail = transform_lists(ops, others[middle:], ops_win)
+    return ops, head + tail
@@ -0,0 +1,117 @@
+import threading
+
+MAX_ENTRIES = 100000
+
+
+class PermissionCache:
+    """
+    In-process cache of (can_read, can_write) per (user_id, file_id) so access checks on
+    the editing hot path do not need the database. Entries are invalidated whenever the
+    access rows of a file change.
+    """
+    def __init__(self, max_entries=MAX_ENTRIES):
+        """
+        Initialize an empty cache.
+
+        :param max_entries: Number of entries after which the cache is emptied
+        :type max_entries: int
+        """
+        self.max_entries = max_entries
+        self.entries = {}
+        self.by_file = {}
+        self.lock = threading.Lock()
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id, file_id):
+        """
+        Look up the cached permissions of a user on a file.
+
+        :param user_id: The id of the user
+        :type user_id: int
+        :param file_id: The id of the file
+        :type file_id: str
+
+        :return: Tuple of (permissions or None, cache version to pass to put on a miss)
+        :rtype: tuple[tuple[bool, bool] or None, int]
+        """
+        with self.lock:
+            permissions = self.entries.get((user_id, file_id))
+            if permissions is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return permissions, self.version
+
+    def put(self, user_id, file_id, permissions, version):
+        """
+        Store permissions read from the database, unless an invalidation happened since the read began.
+
+        :param user_id: The id of the user
+        :type user_id: int
+        :param file_id: The id of the file
+        :type file_id: str
+        :param permissions: Tuple of (can_read, can_write)
+        :type permissions: tuple[bool, bool]
+        :param version: The version returned by get before the database was read
+        :type version: int
+
+        :return: None
+        """
+        with self.lock:
+            if version != self.version:
+                return
+            if len(self.entries) >= self.max_entries:
+                self.entries.clear()
+                self.by_file.clear()
+            self.entries[(user_id, file_id)] = permissions
+            self.by_file.setdefault(file_id, set()).add(user_id)
+
+    def invalidate(self, user_id, file_id):
+        """
+        Forget the permissions of one user on one file.
+
+        :param user_id: The id of the user
+        :type user_id: int
+        :param file_id: The id of the file
+        :type file_id: str
+
+        :return: None
+        """
+        with self.lock:
+            self.version += 1
+            self.entries.pop((user_id, file_id), None)
+            users = self.by_file.get(file_id)
+            if users:
+                users.discard(user_id)
+
+    def invalidate_file(self, file_id):
+        """
+        Forget the permissions of every user on a file.
+
+        :param file_id: The id of the file
+        :type file_id: str
+
+        :return: None
+        """
+        with self.lock:
+            self.version += 1
+            for user_id in self.by_file.pop(file_id, ()):
+                self.entries.pop((user_id, file_id), None)
+
+    def stats(self) -> dict:
+        """
+        Return the hit/miss counters.
+
+        :return: Dictionary with hits, misses, hit_rate and size
+        :rtype: dict
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'size': len(self.entries),
+            }
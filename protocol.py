@@ -1,9 +1,26 @@
+import struct
+import threading
 
-import socket
-import pickle
+import codec
 
+FRAME_MAGIC = 0xCE
+MSG_CODEC = 2  # the only payload encoding; 1 was pickle, which is never decoded
 
-def send(sock, data):
+# magic, message type, flags, request id, payload length
+HEADER = struct.Struct('!BBHII')
+INITIAL_BUFFER_SIZE = 64 * 1024
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+_local = threading.local()
+
+
+class ProtocolError(ConnectionError):
+    """
+    Raised when the peer sends a frame that does not follow the wire format.
+    """
+
+
+def send(sock, data, request_id=0):
     """
     Sends serialized data over a socket with a prefixed length header.
 
@@ -13,14 +30,45 @@ def send(sock, data):
     :param data: The Python object to be serialized and sent
     :type data: Any
 
+    :param request_id: Identifier copied into the frame header
+    :type request_id: int
+
     :return: None
     """
+    sock.sendall(pack(data, request_id))
+
+
+def pack(data, request_id=0):
+    """
+    Serializes data into a complete frame that can be written to any number of sockets.
+
+    :param data: The Python object to be serialized
+    :type data: Any
+
+    :param request_id: Identifier copied into the frame header
+    :type request_id: int
+
+    :return: The frame bytes
+    :rtype: bytes
+    """
+    serialized_data = codec.encode(data)
+    header = HEADER.pack(FRAME_MAGIC, MSG_CODEC, 0, request_id, len(serialized_data))
+    return b''.join((header, serialized_data))
 
-    serialized_data = pickle.dumps(data)
-    length = len(serialized_data)
-    data_to_send = str(length).encode() + '!'.encode() + serialized_data
-    sock.send(data_to_send)
 
+def send_packed(sock, frame):
+    """
+    Sends a frame produced by pack.
+
+    :param sock: The socket object through which the frame is sent
+    :type sock: socket.socket
+
+    :param frame: The frame bytes
+    :type frame: bytes
+
+    :return: None
+    """
+    sock.sendall(frame)
 
 
 def recv(sock):
@@ -33,17 +81,108 @@ def recv(sock):
     :return: The deserialized Python object received from the socket
     :rtype: Any
     """
-    length_data = b''
-    while b'!' not in length_data:
-        length_data += sock.recv(1)
-    length = int(length_data[:-1])  # Remove '!' and convert to int
+    return recv_frame(sock)[3]
 
-    # Receive the full message
-    received_data = b''
-    while len(received_data) < length:
-        chunk = sock.recv(length - len(received_data))
-        if not chunk:
-            raise ConnectionError("Socket connection closed")
-        received_data += chunk
 
-    return pickle.loads(received_data)
+def recv_frame(sock):
+    """
+    Receives one binary frame into the calling thread's reusable buffer and deserializes its payload.
+
+    :param sock: The socket object from which data is received
+    :type sock: socket.socket
+
+    :return: Tuple of (message_type, flags, request_id, data)
+    :rtype: tuple[int, int, int, Any]
+    """
+    buffer = _get_buffer(HEADER.size)
+    with memoryview(buffer) as view:
+        _recv_exactly(sock, view[:HEADER.size])
+        magic, msg_type, flags, request_id, length = HEADER.unpack_from(view)
+
+    if magic != FRAME_MAGIC:
+        raise ProtocolError(f"Bad frame magic {magic:#x}")
+    if length > MAX_FRAME_SIZE:
+        raise ProtocolError(f"Frame of {length} bytes exceeds MAX_FRAME_SIZE")
+
+    buffer = _get_buffer(length)
+    with memoryview(buffer) as view:
+        payload = view[:length]
+        _recv_exactly(sock, payload)
+        data = _decode_payload(msg_type, payload)
+        payload.release()
+
+    return msg_type, flags, request_id, data
+
+
+async def async_recv(reader):
+    """
+    Receives one message from an asyncio stream and deserializes it.
+
+    :param reader: The stream from which data is received
+    :type reader: asyncio.StreamReader
+
+    :return: The deserialized Python object received from the stream
+    :rtype: Any
+    """
+    magic, msg_type, flags, request_id, length = HEADER.unpack(await reader.readexactly(HEADER.size))
+    if magic != FRAME_MAGIC:
+        raise ProtocolError(f"Bad frame magic {magic:#x}")
+    if length > MAX_FRAME_SIZE:
+        raise ProtocolError(f"Frame of {length} bytes exceeds MAX_FRAME_SIZE")
+
+    return _decode_payload(msg_type, await reader.readexactly(length))
+
+
+def _decode_payload(msg_type, payload):
+    """
+    Deserializes a frame payload according to the message type in its header.
+
+    :param msg_type: The message type from the frame header
+    :type msg_type: int
+    :param payload: The payload bytes
+    :type payload: memoryview
+
+    :return: The deserialized Python object
+    :rtype: Any
+    """
+    if msg_type == MSG_CODEC:
+        try:
+            return codec.decode(payload)
+        except codec.CodecError as e:
+            raise ProtocolError(f"Malformed payload: {e}") from e
+    raise ProtocolError(f"Unknown message type {msg_type}")
+
+
+def _get_buffer(size):
+    """
+    Returns the calling thread's receive buffer, growing it to hold at least size bytes.
+
+    :param size: The minimum number of bytes needed
+    :type size: int
+
+    :return: The reusable receive buffer
+    :rtype: bytearray
+    """
+    buffer = getattr(_local, 'buffer', None)
+    if buffer is None or len(buffer) < size:
+        buffer = bytearray(max(size, INITIAL_BUFFER_SIZE, 2 * len(buffer or b'')))
+        _local.buffer = buffer
+    return buffer
+
+
+def _recv_exactly(sock, view):
+    """
+    Fills the given memoryview completely from the socket using recv_into.
+
+    :param sock: The socket object from which data is received
+    :type sock: socket.socket
+    :param view: The writable memoryview to fill
+    :type view: memoryview
+
+    :return: None
+    """
+    while view:
+        received = sock.recv_into(view)
+        if not received:
+            raise ConnectionError("Socket connection closed")
+        view = view[received:]
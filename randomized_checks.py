@@ -0,0 +1,251 @@
+import os
+import random
+import tempfile
+from datetime import datetime
+
+import codec
+import document_journal
+from file import File
+from operation import Operation
+from ot import transform_lists
+from request import Request
+from text_buffer import TextBuffer
+from user import User
+
+TRIALS = 2000
+SEED = 1
+ALPHABET = 'ab\n'  # few distinct characters make overlapping edits and line breaks likely
+INSERT_TEXTS = ['x', 'y', '\n', 'zz', 'q\nr', 'é']
+
+
+def position_of(text: str, offset: int):
+    """
+    Translate an offset into a (line, char) position by scanning the string.
+
+    :param text: The document
+    :type text: str
+    :param offset: The absolute offset
+    :type offset: int
+
+    :return: Tuple of (line, char)
+    :rtype: tuple[int, int]
+    """
+    line = text.count('\n', 0, offset)
+    return line, offset - (text.rfind('\n', 0, offset) + 1)
+
+
+def random_document(rng, max_length=25):
+    """
+    Build a short random document.
+
+    :param rng: The random generator
+    :type rng: random.Random
+    :param max_length: Maximum number of characters
+    :type max_length: int
+
+    :return: The document
+    :rtype: str
+    """
+    return ''.join(rng.choice(ALPHABET) for _ in range(rng.randint(0, max_length)))
+
+
+def random_operations(rng, text: str, count: int):
+    """
+    Build operations that are valid one after the other on a document.
+
+    :param rng: The random generator
+    :type rng: random.Random
+    :param text: The document the first operation applies to
+    :type text: str
+    :param count: Number of operations
+    :type count: int
+
+    :return: Tuple of (operations, document after all of them)
+    :rtype: tuple[list[Operation], str]
+    """
+    ops = []
+    for _ in range(count):
+        if rng.random() < 0.55 or not text:
+            offset = rng.randint(0, len(text))
+            inserted = rng.choice(INSERT_TEXTS)
+            ops.append(Operation('insert', inserted, *position_of(text, offset)))
+            text = text[:offset] + inserted + text[offset:]
+        else:
+            offset = rng.randrange(len(text))
+            end = offset + rng.randint(1, min(6, len(text) - offset))
+            ops.append(Operation('delete', text[offset:end], *position_of(text, offset)))
+            text = text[:offset] + text[end:]
+    return ops, text
+
+
+def apply_all(text: str, ops) -> str:
+    """
+    Apply operations to a document through a TextBuffer.
+
+    :param text: The document
+    :type text: str
+    :param ops: The operations, in order
+    :type ops: list[Operation]
+
+    :return: The resulting document
+    :rtype: str
+    """
+    buffer = TextBuffer(text)
+    for op in ops:
+        op.apply_to(buffer)
+    return buffer.getvalue()
+
+
+def check_ot_convergence(rng, trials=TRIALS):
+    """
+    Two sites edit the same document concurrently; applying the other site's operations
+    transformed against one's own must give both sites the same document.
+
+    :return: None
+    """
+    for _ in range(trials):
+        base = random_document(rng)
+        ours, _ = random_operations(rng, base, rng.randint(0, 6))
+        theirs, _ = random_operations(rng, base, rng.randint(0, 6))
+        ours_first = rng.random() < 0.5
+        ours_after, theirs_after = transform_lists(ours, theirs, ours_first)
+        assert apply_all(base, ours + theirs_after) == apply_all(base, theirs + ours_after), (base, ours_first)
+
+
+def check_text_buffer(rng, trials=TRIALS):
+    """
+    A TextBuffer must hold the same text as plain string edits and translate positions the same way.
+
+    :return: None
+    """
+    for _ in range(trials):
+        text = random_document(rng, 200)
+        buffer = TextBuffer(text)
+        for _ in range(rng.randint(1, 30)):
+            (op,), expected = random_operations(rng, text, 1)
+            op.apply_to(buffer)
+            assert op.apply(text) == expected
+            text = expected
+            assert buffer.getvalue() == text and len(buffer) == len(text)
+
+        assert buffer.line_count() == text.count('\n') + 1
+        for offset in range(len(text) + 1):
+            line, char = position_of(text, offset)
+            assert buffer.position_of(offset) == (line, char)
+            assert buffer.offset_of(line, char) == offset
+
+
+def random_value(rng, depth=0):
+    """
+    Build a random value out of every type the codec encodes.
+
+    :param rng: The random generator
+    :type rng: random.Random
+    :param depth: Current nesting depth
+    :type depth: int
+
+    :return: The value
+    :rtype: Any
+    """
+    owner = User(rng.randint(1, 10 ** 6), 'Ada', 'Lovelace', 'ada', b'hash')
+    leaves = [
+        lambda: None,
+        lambda: rng.random() < 0.5,
+        lambda: rng.randint(-2 ** 70, 2 ** 70),
+        lambda: rng.uniform(-1e9, 1e9),
+        lambda: ''.join(rng.choice('aé\n€😀') for _ in range(rng.randint(0, 8))),
+        lambda: bytes(rng.randrange(256) for _ in range(rng.randint(0, 8))),
+        lambda: datetime(2025, rng.randint(1, 12), rng.randint(1, 28), rng.randint(0, 23)),
+        lambda: Operation(rng.choice(['insert', 'delete']), random_document(rng, 5), rng.randint(0, 500),
+                          rng.randint(0, 500), origin=rng.choice([None, rng.randint(1, 10 ** 6)])),
+        lambda: owner,
+        lambda: File('notes.txt', owner, 'CoEdit_users/ada/notes.txt', creation_date='2025-01-01 10:00:00'),
+    ]
+    if depth >= 4 or rng.random() < 0.5:
+        return rng.choice(leaves)()
+
+    items = [random_value(rng, depth + 1) for _ in range(rng.randint(0, 4))]
+    kind = rng.randrange(4)
+    if kind == 0:
+        return items
+    if kind == 1:
+        return tuple(items)
+    if kind == 2:
+        return {rng.choice([rng.randint(0, 99), str(rng.randint(0, 99))]): item for item in items}
+    return Request('file-content-update', items)
+
+
+def check_codec_round_trip(rng, trials=TRIALS):
+    """
+    Decoding an encoded value must give back a value that encodes to the same bytes, and any
+    truncated or corrupted message must be rejected with a CodecError and nothing else.
+
+    :return: None
+    """
+    for _ in range(trials):
+        data = codec.encode(random_value(rng))
+        assert codec.encode(codec.decode(data)) == data
+
+        corrupted = bytearray(data[:rng.randint(0, len(data))])
+        if corrupted and rng.random() < 0.5:
+            corrupted[rng.randrange(len(corrupted))] = rng.randrange(256)
+        if bytes(corrupted) == data:
+            continue
+        try:
+            codec.decode(bytes(corrupted))
+        except codec.CodecError:
+            pass
+
+
+def check_journal_recovery(rng, trials=TRIALS // 10):
+    """
+    A snapshot plus its journal must read back as every batch that was appended completely,
+    whatever torn tail a crash left; recovery must fold exactly that into the snapshot.
+
+    :return: None
+    """
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            for trial in range(trials):
+                file_id = f'file-{trial}'
+                path = f'{file_id}.txt'
+                content = random_document(rng, 200)
+                document_journal.atomic_write(path, content.encode('utf-8'))
+
+                # Content and journal size after each append
+                states = [(content, 0)]
+                for _ in range(rng.randint(1, 8)):
+                    ops, content = random_operations(rng, content, rng.randint(1, 5))
+                    size = document_journal.append(path, file_id, ops, sync=False)
+                    states.append((content, size))
+
+                journal = document_journal.journal_path(file_id)
+                cut = rng.randint(0, states[-1][1])
+                with open(journal, 'r+b') as f:
+                    f.truncate(cut)
+                expected = [text for text, size in states if size <= cut][-1]
+
+                assert document_journal.read_document(path, file_id) == expected
+                document_journal.recover(path, file_id)
+                assert not os.path.exists(journal)
+                assert document_journal.read_document(path, file_id) == expected
+        finally:
+            os.chdir(cwd)
+
+
+def main():
+    """
+    Run every randomized check with a fixed seed; a failing check raises AssertionError.
+
+    :return: None
+    """
+    checks = [check_ot_convergence, check_text_buffer, check_codec_round_trip, check_journal_recovery]
+    for check in checks:
+        check(random.Random(SEED))
+        print(f"{check.__name__}: ok")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,19 @@
 import socket
 import ssl
-from threading import Thread, Lock, Timer
+from collections import deque
+from threading import Thread, Condition
 
+import document_journal
 import protocol
 from SQLite_database import Database
+from auth_pool import AuthPool
+from broadcast_scheduler import BroadcastScheduler
+from document_store import DocumentStore, StaleRevisionError
 from file import File
 from operation import Operation
+from operation_compactor import OperationCompactor
 from request import Request
+from session_manager import SessionManager
 from user import User
 
 import logging
@@ -14,98 +21,251 @@ logging.basicConfig(filename='server_loggs.log', level=logging.DEBUG)
 
 IP_ADDR = '0.0.0.0'
 PORT = 8468
-QUEUE_LEN = 1
+QUEUE_LEN = 128
 CERT_FILE = 'certificate.crt'
 KEY_FILE = 'privateKey.key'
-UPDATE_INTERVAL = 0.8  # 800ms
+HANDSHAKE_TIMEOUT = 10  # seconds a client may take to complete the TLS handshake
+TLS_SESSION_TICKETS = 2  # TLS 1.3 tickets issued per connection for resumption
+SERVER_MODE = 'asyncio'  # 'asyncio' or 'threaded'
+MAX_OUTBOUND_BYTES = 8 * 1024 * 1024  # drop clients that stop reading
+
+
+class QueuedConnection:
+    """
+    Wrapper around an SSL socket whose sends are queued and written by a writer thread of its
+    own, like StreamConnection in asyncio mode. Broadcast workers and the client's own thread
+    only append to the queue, so a client that stops reading stalls nobody but itself; a client
+    with more than MAX_OUTBOUND_BYTES still queued when its next frame arrives is dropped. One
+    writer also keeps frames from interleaving on the TLS stream. Every other attribute is
+    forwarded to the socket.
+    """
+    def __init__(self, conn, max_queued=MAX_OUTBOUND_BYTES):
+        """
+        Initialize the wrapper and start its writer thread.
+
+        :param conn: The SSL-wrapped socket
+        :type conn: ssl.SSLSocket
+        :param max_queued: Bytes that may wait to be written before the client is dropped on its next frame
+        :type max_queued: int
+        """
+        self.conn = conn
+        self.max_queued = max_queued
+        self.outbound = deque()
+        self.queued_bytes = 0
+        self.closed = False
+        self.ready = Condition()
+        self.writer = Thread(target=self.write_loop, daemon=True)
+        self.writer.start()
+
+    def sendall(self, data):
+        """
+        Queue data for the writer thread.
+
+        :param data: The bytes to send
+        :type data: bytes
+
+        :return: None
+        :raises ConnectionError: If the connection is closed or the client was dropped for not reading
+        """
+        with self.ready:
+            if self.closed:
+                raise ConnectionError("Connection closed")
+            # Only the backlog counts, so a frame larger than the limit still goes to a client that keeps up
+            if self.queued_bytes > self.max_queued:
+                logging.error(f"Dropping {self.conn}: more than {self.max_queued} bytes waiting to be sent")
+                self.abort()
+                raise ConnectionError("Client is not reading")
+            self.outbound.append(data)
+            self.queued_bytes += len(data)
+            self.ready.notify()
+
+    def write_loop(self):
+        """
+        Write queued data to the socket until the connection is closed.
+
+        :return: None
+        """
+        while True:
+            with self.ready:
+                while not self.outbound and not self.closed:
+                    self.ready.wait()
+                if self.closed:
+                    return
+                data = self.outbound.popleft()
+                self.queued_bytes -= len(data)
+            try:
+                self.conn.sendall(data)
+            except (socket.error, ValueError) as e:
+                logging.error(f"Error sending to {self.conn}: {e}")
+                with self.ready:
+                    self.abort()
+                return
+
+    def abort(self):
+        """
+        Discard the queue and shut the socket down, which also ends the client's listen loop;
+        called with the queue's condition held.
+
+        :return: None
+        """
+        self.closed = True
+        self.outbound.clear()
+        self.queued_bytes = 0
+        self.ready.notify()
+        try:
+            self.conn.shutdown(socket.SHUT_RDWR)
+        except (socket.error, ValueError):
+            pass
+
+    def close(self):
+        """
+        Stop the writer thread and close the socket.
+
+        :return: None
+        """
+        with self.ready:
+            self.abort()
+        self.conn.close()
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
 
 
 class Server:
-    def __init__(self):
-        self.open_files = {}
+    def __init__(self, backlog=QUEUE_LEN):
+        """
+        Initialize the server state, TLS context and database.
+
+        :param backlog: Listen backlog of the server socket
+        :type backlog: int
+        """
+        self.backlog = backlog
         self.context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
         self.context.load_cert_chain(CERT_FILE, KEY_FILE)
+        self.context.options &= ~ssl.OP_NO_TICKET
+        self.context.num_tickets = TLS_SESSION_TICKETS
 
-        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server_socket.bind((IP_ADDR, PORT))
-        self.server_socket.listen(QUEUE_LEN)
-
-        self.s_sock = self.context.wrap_socket(self.server_socket, server_side=True)
+        self.server_socket = None
         self.thread_list = []
         self.database = Database()
+        self.recover_documents()
+        self.documents = DocumentStore(self.database)
+        self.scheduler = BroadcastScheduler(self.flush_document)
+        self.compactor = OperationCompactor()
+        self.auth_pool = AuthPool()
+        self.sessions = SessionManager()
 
-        self.pending_changes = {}
-        self.pending_changes_lock = Lock()
-
-        self.update_timer = None
-        self.start_update_timer()
-
-    def start_update_timer(self):
+    def recover_documents(self):
         """
-        Start a timer that triggers the sending of batched file content updates every UPDATE_INTERVAL seconds.
+        Rebuild the documents that were open when the server last stopped by folding their
+        journals into new snapshots, and remove half-written temp files and orphaned journals.
 
         :return: None
         """
-        self.update_timer = Timer(UPDATE_INTERVAL, self.send_batched_updates)
-        self.update_timer.daemon = True
-        self.update_timer.start()
+        recovered = document_journal.recover_all(self.database.get_file_paths())
+        if recovered:
+            logging.info(f"Recovered {recovered} documents from their journals")
 
-    def send_batched_updates(self):
+    def flush_pending_changes(self):
         """
-        Send all pending file content changes to appropriate clients with read access, and schedule the next update.
+        Send the pending changes of every document right away.
 
         :return: None
         """
-        try:
-            with self.pending_changes_lock:
-                for file_id, conn_changes in list(self.pending_changes.items()):
-                    if file_id not in self.open_files:
-                        continue
-
-                    for sender_conn, changes in list(conn_changes.items()):
-                        if not changes:
-                            continue
-
-                        file = changes[0][0]
-                        all_changes = []
-                        for _, change_list in changes:
-                            all_changes.extend(change_list)
-
-                        logging.debug(f"Broadcasting changes for file {file_id} from sender {sender_conn}")
-                        for user, conn in self.open_files.get(file_id, []):
-                            if conn == sender_conn:
-                                continue
-
-                            logging.debug(f"Checking read access for {user.username} on file {file_id}")
-                            if self.database.can_user_read(user, file):
-                                logging.debug(f"User {user.username} has read access, sending update.")
-                                try:
-                                    protocol.send(conn, Request('file-content-update', [file, all_changes]))
-                                except Exception as e:
-                                    logging.error(f"Error sending batched update to {user.username}: {e}")
-                            else:
-                                logging.debug(f"User {user.username} does NOT have read access.")
-                self.pending_changes.clear()
+        for doc in self.documents.all():
+            try:
+                self.flush_document(doc)
+            except Exception as e:
+                logging.error(f"Error broadcasting document {doc.file_id}: {e}")
 
-        except Exception as e:
-            logging.error(f"Error in send_batched_updates: {e}")
+    def flush_document(self, doc):
+        """
+        Send a document's pending changes to its subscribers with read access and clear them.
+        The queue is detached under the document's lock only; permission checks and queueing the
+        frame on each connection run under its broadcast lock, which keeps the frames of one
+        document in order. Connections write on their own threads, so a slow reader blocks nobody.
 
-        finally:
-            self.start_update_timer()
+        :param doc: The document to broadcast
+        :type doc: LiveDocument
+
+        :return: None
+        """
+        with doc.broadcast_lock:
+            file, batches, subscribers = doc.take_pending()
+            if not batches:
+                return
+            # The batches must be journaled before their authors see them acknowledged
+            if doc.closed or not self.documents.commit(doc):
+                if doc.closed:
+                    # The file was deleted, so the batches can never be journaled; drop them
+                    logging.debug(f"Dropping revisions up to {batches[-1][0]} of deleted document {doc.file_id}")
+                    return
+                doc.restore_pending(batches)
+                self.scheduler.retry(doc)
+                logging.error(f"Holding back revisions up to {batches[-1][0]} of {doc.file_id} until they are journaled")
+                return
+
+            # Consecutive batches of one connection travel as one; the sender reads its own batch as the ack
+            batches = self.compactor.compact_batches(batches)
+            frame = protocol.pack(Request('file-content-update', [file, batches]))
+
+            logging.debug(f"Broadcasting revisions up to {batches[-1][0]} for file {doc.file_id}, "
+                          f"compaction {self.compactor.stats()}")
+            for user, conn in subscribers:
+                logging.debug(f"Checking read access for {user.username} on file {doc.file_id}")
+                if self.database.can_user_read(user, file):
+                    logging.debug(f"User {user.username} has read access, sending update.")
+                    try:
+                        protocol.send_packed(conn, frame)
+                    except Exception as e:
+                        logging.error(f"Error sending batched update to {user.username}: {e}")
+                else:
+                    logging.debug(f"User {user.username} does NOT have read access.")
 
     def start_server(self):
         """
-        Start the server to listen for incoming SSL connections and spawn a new thread for each client.
+        Start the server to listen for incoming connections and spawn a new thread for each client.
+        The TLS handshake runs on the client's thread, so a slow client never blocks accept.
 
         :return: None
         """
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.bind((IP_ADDR, PORT))
+        self.server_socket.listen(self.backlog)
+        self.documents.start()
+        self.scheduler.start()
+
         while True:
-            conn, addr = self.s_sock.accept()
-            logging.debug(f'received a connection from {conn}, {addr}')
-            thread = Thread(target=self.listen, args=(conn,))
+            raw_conn, addr = self.server_socket.accept()
+            logging.debug(f'received a connection from {addr}')
+            thread = Thread(target=self.handle_connection, args=(raw_conn, addr))
             thread.start()
             self.thread_list.append(thread)
 
+    def handle_connection(self, raw_conn, addr):
+        """
+        Perform the TLS handshake on an accepted socket and then serve the client.
+
+        :param raw_conn: The accepted, not yet encrypted socket
+        :type raw_conn: socket.socket
+        :param addr: The client address
+        :type addr: tuple
+
+        :return: None
+        """
+        try:
+            conn = self.context.wrap_socket(raw_conn, server_side=True, do_handshake_on_connect=False)
+            conn.settimeout(HANDSHAKE_TIMEOUT)
+            conn.do_handshake()
+            conn.settimeout(None)
+        except (socket.error, ssl.SSLError) as e:
+            logging.error(f'TLS handshake with {addr} failed: {e}')
+            raw_conn.close()
+            return
+
+        logging.debug(f'TLS established with {addr}, session reused: {conn.session_reused}')
+        self.listen(QueuedConnection(conn))
+
     def listen(self, conn):
         """
         Continuously listen for requests from a specific client and delegate request handling.
@@ -128,26 +288,18 @@ class Server:
 
     def cleanup_connection(self, conn):
         """
-        Clean up all references to a disconnected client connection from open files and pending changes.
+        Clean up all references to a disconnected client connection from open files.
+        Changes it already made stay pending, since they were applied to the document.
 
         :param conn: The client connection to clean up
         :type conn: ssl.SSLSocket
 
         :return: None
         """
-        # Remove connection from open_files
-        for file_id in list(self.open_files):
-            self.open_files[file_id] = [(u, c) for u, c in self.open_files[file_id] if c != conn]
-            if not self.open_files[file_id]:
-                del self.open_files[file_id]
-
-        # Remove connection from pending_changes
-        with self.pending_changes_lock:
-            for file_id in list(self.pending_changes):
-                if conn in self.pending_changes[file_id]:
-                    del self.pending_changes[file_id][conn]
-                if not self.pending_changes[file_id]:
-                    del self.pending_changes[file_id]
+        # Remove the connection from every document, closing documents nobody has open anymore
+        self.documents.unsubscribe(conn)
+        # The session stays valid so the client can resume it on a new connection
+        self.sessions.unbind(conn)
 
     def handle_request(self, request: Request, conn):
         """
@@ -163,22 +315,33 @@ class Server:
         logging.debug(f"received from client : {request}")
         if request.request_type == 'signup':
             self.handle_signup(request.data, conn)
+            return
         elif request.request_type == 'login':
             self.handle_login(request.data, conn)
             return
-        elif request.request_type == 'add-file':
-            file, user = request.data
+        elif request.request_type == 'resume-session':
+            self.handle_resume_session(request.data, conn)
+            return
+
+        # Everything else acts as the user of the connection's session, never as a User sent by the client
+        user = self.sessions.user_for(conn)
+        if user is None:
+            logging.warning(f"Ignoring {request.request_type} from {conn}: no session")
+            return
+
+        if request.request_type == 'add-file':
+            file = request.data[0]
             self.handle_add_file(file, user, conn)
         elif request.request_type == 'refresh-files':
-            self.get_user_files(request.data, conn)
+            self.get_user_files(user, conn)
         elif request.request_type == 'rename-file':
             file, new_name= request.data
             self.handle_file_rename(file, new_name, conn)
         elif request.request_type == 'delete-file':
-            file, user = request.data
+            file = request.data[0]
             self.handle_delete_file(file, user, conn)
         elif request.request_type == "open-file":
-            user, file = request.data
+            file = request.data[1]
             self.handle_open_file(user, file, conn)
         elif request.request_type == 'get-access-list':
             self.handle_get_access_list(request.data, conn)
@@ -188,10 +351,11 @@ class Server:
             file, updated_access = request.data
             self.handle_update_access_table(file, updated_access, conn)
         elif request.request_type == 'file-content-update':
-            file, changes, user = request.data
-            self.handle_file_content_update(file, changes, user, conn)
+            file, changes = request.data[:2]
+            base_revision = request.data[3] if len(request.data) > 3 else None
+            self.handle_file_content_update(file, changes, user, conn, base_revision)
         elif request.request_type == 'logout':
-            self.handle_logout(request.data, conn)
+            self.handle_logout(user, conn)
 
     def handle_logout(self, user: User, conn):
         """
@@ -206,27 +370,20 @@ class Server:
         """
         logging.debug(f"User {user.username} is logging out...")
 
-        # Clean up open_files
-        for file_id in list(self.open_files):
-            self.open_files[file_id] = [(u, c) for u, c in self.open_files[file_id] if c != conn]
-            if not self.open_files[file_id]:
-                del self.open_files[file_id]
-
-        # Clean up pending_changes
-        with self.pending_changes_lock:
-            for file_id in list(self.pending_changes):
-                if conn in self.pending_changes[file_id]:
-                    del self.pending_changes[file_id][conn]
-                if not self.pending_changes[file_id]:
-                    del self.pending_changes[file_id]
+        token = self.sessions.unbind(conn)
+        if token:
+            self.sessions.revoke(token)
+        self.cleanup_connection(conn)
 
         logging.debug(f"User {user.username} logged out and cleaned up.")
 
         protocol.send(conn, Request('logout_success', True))
 
-    def handle_file_content_update(self, file, changes, user, conn):
+    def handle_file_content_update(self, file, changes, user, conn, base_revision=None):
         """
         Apply a list of operations (changes) to a file's content and schedule the update to be sent to readers.
+        Changes made on an older revision are transformed against the ones applied since; if that
+        revision is no longer in the document's history the client is sent the current content instead.
 
         :param file: The file to be updated
         :type file: File
@@ -236,27 +393,31 @@ class Server:
         :type user: User
         :param conn: The connection through which the request was received
         :type conn: ssl.SSLSocket
+        :param base_revision: The revision the client made the changes on, None for the current one
+        :type base_revision: int or None
 
         :return: None
         """
-        current_content = self.database.get_file_content(user, file)
-
-        updated_content = current_content
-        for op in changes:
-            updated_content = op.apply(updated_content)
+        if not self.database.check_write(user, file):
+            protocol.send(conn, Request('write-access-response', [file, False]))
+            return
 
-        can_write = self.database.update_file_content(user, file, updated_content)
-        if can_write:
-            with self.pending_changes_lock:
-                if file.file_id not in self.pending_changes:
-                    self.pending_changes[file.file_id] = {}
+        # Even an empty batch gets a revision, since the client waits for it as its ack
+        changes = self.compactor.compact(changes)
 
-                if conn not in self.pending_changes[file.file_id]:
-                    self.pending_changes[file.file_id][conn] = []
+        # Applying also queues the changes on the document; the scheduler decides when they are broadcast
+        try:
+            doc = self.documents.apply(user, file, changes, conn, base_revision)
+        except StaleRevisionError as e:
+            logging.debug(f"Resyncing {user.username}: {e}")
+            content, revision, origin = self.documents.open(user, file, conn)
+            protocol.send(conn, Request('file-resync', [file, content, revision, origin]))
+            return
 
-                self.pending_changes[file.file_id][conn].append((file, changes))
+        if doc:
+            self.scheduler.schedule(doc, doc.pending_ops)
         else:
-            protocol.send(conn, Request('write-access-response', [file, can_write]))
+            protocol.send(conn, Request('write-access-response', [file, False]))
 
     def handle_open_file(self, user: User, file: File, conn):
         """
@@ -271,18 +432,14 @@ class Server:
 
         :return: None
         """
-        content = self.database.get_file_content(user, file)
-
-        if file.file_id not in self.open_files:
-            self.open_files[file.file_id] = []
-        if not any(u.username == user.username for u, _ in self.open_files[file.file_id]):
-            self.open_files[file.file_id].append((user, conn))
+        content, revision, origin = self.documents.open(user, file, conn)
 
-        protocol.send(conn, Request('file-content', [file, content]))
+        protocol.send(conn, Request('file-content', [file, content, revision, origin]))
 
     def handle_update_access_table(self, file: File, updated_access,  conn):
         """
-        Update the access table for a file based on the provided new access list.
+        Update the access table for a file based on the provided new access list, in one transaction.
+        Entries naming users that do not exist are skipped.
 
         :param file: The file whose access table is being updated
         :type file: File
@@ -294,14 +451,8 @@ class Server:
         :return: None
         """
         try:
-            for access in updated_access:
-                username = access["username"]
-                can_read = access["read"]
-                can_write = access["write"]
-
-                user = self.database.check_if_user_exists_by_username(username)
-                if user:
-                    self.database.change_file_access(user, file, can_read, can_write)
+            updated = self.database.update_file_access(file, updated_access)
+            logging.debug(f"Updated access of {updated}/{len(updated_access)} users to {file.file_id}")
             protocol.send(conn, Request('update-access-response', True))
         except Exception as e:
             logging.error(f"Failed to update access table: {e}")
@@ -319,6 +470,8 @@ class Server:
         :return: None
         """
         user = self.database.check_if_user_exists_by_username(username)
+        if user:
+            user.password = None
         protocol.send(conn, Request('user-exists-response', user))
 
     def handle_get_access_list(self, file: File, conn):
@@ -352,23 +505,76 @@ class Server:
     def handle_login(self, user: User, conn):
         """
         Authenticate a user and respond to the client with success or failure, and send accessible files if successful.
+        The password check runs on the auth pool; the response is sent when it completes.
+
+        :param user: The user attempting to log in
+        :type user: User
+        :param conn: The client connection
+        :type conn: ssl.SSLSocket
+
+        :return: None
+        """
+        user_id, stored_hash = self.database.get_login(user.username)
+        if user_id is None:
+            self.finish_login(user, None, False, conn)
+            return
+
+        queued = self.auth_pool.submit(user.password, stored_hash,
+                                       lambda success: self.finish_login(user, user_id, success, conn))
+        if not queued:
+            logging.error(f"Login of {user.username} rejected, auth queue full: {self.auth_pool.stats()}")
+            self.finish_login(user, None, False, conn)
+
+    def finish_login(self, user: User, user_id, success: bool, conn):
+        """
+        Send the login result and, on success, a session token and the user's files.
 
         :param user: The user attempting to log in
         :type user: User
+        :param user_id: The id of the user, or None if unknown
+        :type user_id: int or None
+        :param success: Whether the password matched
+        :type success: bool
         :param conn: The client connection
         :type conn: ssl.SSLSocket
 
         :return: None
         """
-        success, user_id = self.database.verify_user(user)
-        logging.debug('login was successful? : ' + str(success))
-        user.user_id = user_id
+        logging.debug(f'login was successful? : {success}, auth pool {self.auth_pool.stats()}')
+        user.user_id = user_id if success else None
+        # The password is never sent back; later requests are identified by the session
+        user.password = None
+        token = None
         if success:
             user.first_name, user.last_name = self.database.get_user_full_name(user.username)
-        protocol.send(conn, Request('login-success', [success, user]))
+            token = self.sessions.create(user)
+            self.sessions.bind(conn, user, token)
+        protocol.send(conn, Request('login-success', [success, user, token]))
         if success:
             self.get_user_files(user, conn)
 
+    def handle_resume_session(self, token: str, conn):
+        """
+        Log a reconnecting client back in with the session token it got at login, without
+        checking the password again or resending the file list.
+
+        :param token: The session token
+        :type token: str
+        :param conn: The client connection
+        :type conn: ssl.SSLSocket
+
+        :return: None
+        """
+        user = self.sessions.resume(token)
+        if user is None:
+            logging.debug(f"Rejected session resume from {conn}")
+            protocol.send(conn, Request('resume-session-response', [False, None]))
+            return
+
+        self.sessions.bind(conn, user, token)
+        logging.debug(f"User {user.username} resumed their session")
+        protocol.send(conn, Request('resume-session-response', [True, user]))
+
     def get_user_files(self, user: User, conn):
         """
         Retrieve and send the list of files accessible to a user.
@@ -441,12 +647,8 @@ class Server:
             success = self.database.delete_file(file, user)
 
             if success:
-                if file.file_id in self.open_files:
-                    del self.open_files[file.file_id]
-
-                with self.pending_changes_lock:
-                    if file.file_id in self.pending_changes:
-                        del self.pending_changes[file.file_id]
+                # Drops the document together with its subscribers and pending changes
+                self.documents.discard(file.file_id)
 
             protocol.send(conn, Request('delete-file-response', success))
 
@@ -454,6 +656,24 @@ class Server:
             logging.error(f"Error deleting file {file.file_id}: {e}")
             protocol.send(conn, Request('delete-file-response', [file, False]))
 
+    def shutdown(self):
+        """
+        Broadcast what is still pending and write every edited document back to disk before the server exits.
+
+        :return: None
+        """
+        self.scheduler.stop()
+        self.auth_pool.shutdown()
+        self.flush_pending_changes()
+        self.documents.shutdown()
+
 if __name__ == "__main__":
-    server = Server()
-    server.start_server()
\ No newline at end of file
+    if SERVER_MODE == 'asyncio':
+        from async_server import AsyncServer
+        server = AsyncServer()
+    else:
+        server = Server()
+    try:
+        server.start_server()
+    finally:
+        server.shutdown()
\ No newline at end of file
@@ -0,0 +1,167 @@
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+
+from user import User
+
+SESSION_TTL = 12 * 60 * 60  # seconds a session token stays valid
+
+
+class SessionManager:
+    """
+    Issues signed, expiring session tokens at login and keeps the server-side session table.
+
+    A token is '<session id>.<expiry>.<signature>' where the signature is an HMAC-SHA256 over the
+    id and expiry with a key that lives only in this process. Tokens are checked against the
+    table as well, so logging out revokes them immediately. Connections are bound to the user of
+    their session, which is how requests are attributed instead of trusting the client's User.
+    """
+    def __init__(self, ttl=SESSION_TTL, secret=None):
+        """
+        Initialize an empty session table.
+
+        :param ttl: Seconds a token stays valid
+        :type ttl: int
+        :param secret: HMAC key; a random one is generated if None
+        :type secret: bytes or None
+        """
+        self.ttl = ttl
+        self.secret = secret or os.urandom(32)
+        self.sessions = {}  # session id -> (User, expiry)
+        self.connections = {}  # connection -> (User, session token)
+        self.lock = threading.Lock()
+
+    def sign(self, session_id: str, expires: int) -> str:
+        """
+        Return the signature of a session id and expiry.
+        """
+        message = f'{session_id}.{expires}'.encode()
+        digest = hmac.new(self.secret, message, hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(digest).rstrip(b'=').decode()
+
+    def create(self, user: User) -> str:
+        """
+        Start a session for a user who just logged in.
+
+        :param user: The authenticated user
+        :type user: User
+
+        :return: The session token to hand to the client
+        :rtype: str
+        """
+        session_id = secrets.token_urlsafe(18)
+        expires = int(time.time()) + self.ttl
+        with self.lock:
+            self.purge_expired()
+            self.sessions[session_id] = (user, expires)
+        return f'{session_id}.{expires}.{self.sign(session_id, expires)}'
+
+    def parse(self, token: str):
+        """
+        Check a token's signature and expiry.
+
+        :param token: The token sent by a client
+        :type token: str
+
+        :return: The session id, or None if the token is forged, malformed or expired
+        :rtype: str or None
+        """
+        try:
+            session_id, expires, signature = token.split('.')
+            expires = int(expires)
+        except (AttributeError, ValueError):
+            return None
+        # Compare bytes: compare_digest rejects str arguments with non-ASCII characters
+        if not hmac.compare_digest(signature.encode(), self.sign(session_id, expires).encode()):
+            return None
+        if expires < time.time():
+            return None
+        return session_id
+
+    def resume(self, token: str):
+        """
+        Return the user of a valid session token.
+
+        :param token: The token sent by a client
+        :type token: str
+
+        :return: The user the session belongs to, or None if the token is not valid
+        :rtype: User or None
+        """
+        session_id = self.parse(token)
+        if session_id is None:
+            return None
+        with self.lock:
+            session = self.sessions.get(session_id)
+        return session[0] if session else None
+
+    def revoke(self, token: str):
+        """
+        End a session, used at logout.
+
+        :param token: The token of the session
+        :type token: str
+
+        :return: None
+        """
+        session_id = self.parse(token)
+        with self.lock:
+            self.sessions.pop(session_id, None)
+
+    def bind(self, conn, user: User, token: str):
+        """
+        Attribute every later request on a connection to a session's user.
+
+        :param conn: The client connection
+        :type conn: ssl.SSLSocket
+        :param user: The user of the session
+        :type user: User
+        :param token: The token of the session
+        :type token: str
+
+        :return: None
+        """
+        with self.lock:
+            self.connections[conn] = (user, token)
+
+    def unbind(self, conn):
+        """
+        Forget the session of a connection; the session itself stays valid for a later resume.
+
+        :param conn: The client connection
+        :type conn: ssl.SSLSocket
+
+        :return: The token the connection was bound to, or None
+        :rtype: str or None
+        """
+        with self.lock:
+            binding = self.connections.pop(conn, None)
+        return binding[1] if binding else None
+
+    def user_for(self, conn):
+        """
+        Return the user a connection is logged in as.
+
+        :param conn: The client connection
+        :type conn: ssl.SSLSocket
+
+        :return: The user, or None if the connection has no session
+        :rtype: User or None
+        """
+        with self.lock:
+            binding = self.connections.get(conn)
+        return binding[0] if binding else None
+
+    def purge_expired(self):
+        """
+        Drop expired sessions; called with the lock held.
+
+        :return: None
+        """
+        now = time.time()
+        for session_id in [sid for sid, (_, expires) in self.sessions.items() if expires < now]:
+            del self.sessions[session_id]
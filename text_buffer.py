@@ -0,0 +1,353 @@
+import random
+
+MAX_CHUNK = 512  # characters stored per tree node
+
+
+class _Node:
+    """
+    A treap node holding one chunk of text and the totals of its subtree.
+    """
+    __slots__ = ('text', 'newlines', 'priority', 'left', 'right', 'length', 'line_breaks')
+
+    def __init__(self, text: str, priority=None):
+        self.text = text
+        self.newlines = text.count('\n')
+        self.priority = random.random() if priority is None else priority
+        self.left = None
+        self.right = None
+        self.length = len(text)
+        self.line_breaks = self.newlines
+
+
+def _update(node: _Node):
+    """
+    Recompute the subtree totals of a node from its chunk and children.
+    """
+    length = len(node.text)
+    line_breaks = node.newlines
+    if node.left:
+        length += node.left.length
+        line_breaks += node.left.line_breaks
+    if node.right:
+        length += node.right.length
+        line_breaks += node.right.line_breaks
+    node.length = length
+    node.line_breaks = line_breaks
+
+
+def _merge(left, right):
+    """
+    Concatenate two treaps.
+    """
+    if left is None:
+        return right
+    if right is None:
+        return left
+    if left.priority > right.priority:
+        left.right = _merge(left.right, right)
+        _update(left)
+        return left
+    right.left = _merge(left, right.left)
+    _update(right)
+    return right
+
+
+def _split(node, offset):
+    """
+    Split a treap into the first offset characters and the rest.
+    """
+    if node is None:
+        return None, None
+
+    left_length = node.left.length if node.left else 0
+    if offset <= left_length:
+        left, right = _split(node.left, offset)
+        node.left = right
+        _update(node)
+        return left, node
+
+    offset -= left_length
+    if offset >= len(node.text):
+        left, right = _split(node.right, offset - len(node.text))
+        node.right = left
+        _update(node)
+        return node, right
+
+    # The split point is inside this chunk; the tail keeps the priority so the heap order holds
+    tail = _Node(node.text[offset:], node.priority)
+    tail.right = node.right
+    _update(tail)
+    node.text = node.text[:offset]
+    node.newlines = node.text.count('\n')
+    node.right = None
+    _update(node)
+    return node, tail
+
+
+def _insert_in_place(node, offset, text):
+    """
+    Splice text into an existing chunk when it still fits, updating totals on the way back up.
+
+    :return: True if the text was inserted
+    """
+    if node is None:
+        return False
+
+    left_length = node.left.length if node.left else 0
+    if offset <= left_length and node.left is not None:
+        inserted = _insert_in_place(node.left, offset, text)
+    elif offset - left_length <= len(node.text):
+        index = offset - left_length
+        if len(node.text) + len(text) > MAX_CHUNK:
+            return False
+        node.text = node.text[:index] + text + node.text[index:]
+        node.newlines += text.count('\n')
+        inserted = True
+    else:
+        inserted = _insert_in_place(node.right, offset - left_length - len(node.text), text)
+
+    if inserted:
+        node.length += len(text)
+        node.line_breaks += text.count('\n')
+    return inserted
+
+
+def _build(chunks):
+    """
+    Build a balanced treap from a list of chunks in document order.
+    """
+    if not chunks:
+        return None
+
+    nodes = [_Node(chunk) for chunk in chunks]
+
+    def link(low, high):
+        if low > high:
+            return None
+        middle = (low + high) // 2
+        node = nodes[middle]
+        node.left = link(low, middle - 1)
+        node.right = link(middle + 1, high)
+        _update(node)
+        return node
+
+    root = link(0, len(nodes) - 1)
+
+    # Hand out descending priorities in breadth-first order so every parent outranks its children
+    priorities = sorted((random.random() for _ in nodes), reverse=True)
+    level = [root]
+    index = 0
+    while level:
+        next_level = []
+        for node in level:
+            node.priority = priorities[index]
+            index += 1
+            next_level.extend(child for child in (node.left, node.right) if child)
+        level = next_level
+    return root
+
+
+def _chunks(text: str):
+    """
+    Cut text into MAX_CHUNK sized pieces.
+    """
+    return [text[i:i + MAX_CHUNK] for i in range(0, len(text), MAX_CHUNK)]
+
+
+class TextBuffer:
+    """
+    Rope-style text buffer: a treap of text chunks where every node knows the length and
+    number of line breaks of its subtree. Inserts, deletes and (line, char) <-> offset
+    translations take O(log n) node visits plus O(MAX_CHUNK) work in a single chunk.
+
+    Lines are separated by '\\n', matching the Tk text widget the clients edit in.
+    """
+    def __init__(self, text: str = ''):
+        """
+        Initialize the buffer with its starting content.
+
+        :param text: The initial content
+        :type text: str
+        """
+        self.root = _build(_chunks(text))
+
+    def __len__(self):
+        return self.root.length if self.root else 0
+
+    def __str__(self):
+        return self.getvalue()
+
+    def getvalue(self) -> str:
+        """
+        Return the whole content as a string.
+
+        :return: The buffer content
+        :rtype: str
+        """
+        parts = []
+        stack = []
+        node = self.root
+        while stack or node:
+            while node:
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            parts.append(node.text)
+            node = node.right
+        return ''.join(parts)
+
+    def line_count(self) -> int:
+        """
+        Return the number of lines, counting a trailing empty line after a final line break.
+
+        :return: The number of lines
+        :rtype: int
+        """
+        return (self.root.line_breaks if self.root else 0) + 1
+
+    def line_start(self, line: int) -> int:
+        """
+        Return the offset at which a line starts; lines past the end start at the end of the buffer.
+
+        :param line: Zero-based line number
+        :type line: int
+
+        :return: The absolute offset of the first character of the line
+        :rtype: int
+        """
+        if line <= 0:
+            return 0
+        if self.root is None or line > self.root.line_breaks:
+            return len(self)
+
+        # Find the offset of the line-th line break
+        remaining = line
+        base = 0
+        node = self.root
+        while node:
+            left_breaks = node.left.line_breaks if node.left else 0
+            if remaining <= left_breaks:
+                node = node.left
+                continue
+            remaining -= left_breaks
+            base += node.left.length if node.left else 0
+            if remaining <= node.newlines:
+                index = -1
+                for _ in range(remaining):
+                    index = node.text.index('\n', index + 1)
+                return base + index + 1
+            remaining -= node.newlines
+            base += len(node.text)
+            node = node.right
+        return len(self)
+
+    def offset_of(self, line: int, char: int) -> int:
+        """
+        Translate a (line, char) position into an absolute offset, clamped to the buffer.
+
+        :param line: Zero-based line number
+        :type line: int
+        :param char: Zero-based character within the line
+        :type char: int
+
+        :return: The absolute offset
+        :rtype: int
+        """
+        return min(self.line_start(line) + char, len(self))
+
+    def position_of(self, offset: int):
+        """
+        Translate an absolute offset into a (line, char) position.
+
+        :param offset: The absolute offset
+        :type offset: int
+
+        :return: Tuple of (line, char)
+        :rtype: tuple[int, int]
+        """
+        offset = max(0, min(offset, len(self)))
+        line = 0
+        remaining = offset
+        node = self.root
+        while node:
+            left_length = node.left.length if node.left else 0
+            if remaining <= left_length:
+                node = node.left
+                continue
+            line += node.left.line_breaks if node.left else 0
+            remaining -= left_length
+            if remaining <= len(node.text):
+                line += node.text.count('\n', 0, remaining)
+                break
+            line += node.newlines
+            remaining -= len(node.text)
+            node = node.right
+        return line, offset - self.line_start(line)
+
+    def insert(self, offset: int, text: str):
+        """
+        Insert text at an absolute offset.
+
+        :param offset: The absolute offset, clamped to the buffer
+        :type offset: int
+        :param text: The text to insert
+        :type text: str
+
+        :return: None
+        """
+        if not text:
+            return
+        offset = max(0, min(offset, len(self)))
+        if _insert_in_place(self.root, offset, text):
+            return
+
+        left, right = _split(self.root, offset)
+        self.root = _merge(_merge(left, _build(_chunks(text))), right)
+
+    def delete(self, offset: int, length: int):
+        """
+        Delete length characters starting at an absolute offset.
+
+        :param offset: The absolute offset, clamped to the buffer
+        :type offset: int
+        :param length: The number of characters to delete
+        :type length: int
+
+        :return: None
+        """
+        offset = max(0, min(offset, len(self)))
+        if length <= 0:
+            return
+        left, rest = _split(self.root, offset)
+        _, right = _split(rest, length)
+        self.root = _merge(left, right)
+
+    def insert_at(self, line: int, char: int, text: str):
+        """
+        Insert text at a (line, char) position.
+
+        :param line: Zero-based line number
+        :type line: int
+        :param char: Zero-based character within the line
+        :type char: int
+        :param text: The text to insert
+        :type text: str
+
+        :return: None
+        """
+        self.insert(self.offset_of(line, char), text)
+
+    def delete_at(self, line: int, char: int, length: int):
+        """
+        Delete length characters starting at a (line, char) position.
+
+        :param line: Zero-based line number
+        :type line: int
+        :param char: Zero-based character within the line
+        :type char: int
+        :param length: The number of characters to delete
+        :type length: int
+
+        :return: None
+        """
+        self.delete(self.offset_of(line, char), length)
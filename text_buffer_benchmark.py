@@ -0,0 +1,83 @@
+import random
+import time
+
+from operation import Operation
+from text_buffer import TextBuffer
+
+DOCUMENT_SIZE = 1024 * 1024
+LINE_LENGTH = 80
+OPERATIONS = 2000
+
+
+def make_document(size=DOCUMENT_SIZE):
+    """
+    Build a document of roughly size characters made of LINE_LENGTH character lines.
+
+    :param size: Approximate number of characters
+    :type size: int
+
+    :return: The document
+    :rtype: str
+    """
+    line = 'x' * (LINE_LENGTH - 1) + '\n'
+    return line * (size // LINE_LENGTH)
+
+
+def make_operations(line_count, count=OPERATIONS, seed=1):
+    """
+    Build typing-like single character inserts and deletes at random lines.
+
+    :param line_count: Number of lines in the document
+    :type line_count: int
+    :param count: Number of operations
+    :type count: int
+    :param seed: Random seed so both approaches see the same operations
+    :type seed: int
+
+    :return: The operations
+    :rtype: list[Operation]
+    """
+    rng = random.Random(seed)
+    ops = []
+    for _ in range(count):
+        line = rng.randrange(line_count)
+        char = rng.randrange(LINE_LENGTH - 1)
+        if rng.random() < 0.7:
+            ops.append(Operation('insert', 'a', line, char))
+        else:
+            ops.append(Operation('delete', 'x', line, char))
+    return ops
+
+
+def main():
+    """
+    Apply the same operations to a 1 MB document with Operation.apply on strings and with a TextBuffer.
+
+    :return: None
+    """
+    document = make_document()
+    ops = make_operations(document.count('\n'))
+
+    start = time.perf_counter()
+    content = document
+    for op in ops:
+        content = op.apply(content)
+    string_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    buffer = TextBuffer(document)
+    build_time = time.perf_counter() - start
+    start = time.perf_counter()
+    for op in ops:
+        op.apply_to(buffer)
+    buffer_time = time.perf_counter() - start
+
+    assert buffer.getvalue() == content
+    print(f"document: {len(document)} chars, {len(ops)} operations")
+    print(f"str + Operation.apply:   {string_time:8.3f} s  ({string_time / len(ops) * 1e6:10.1f} us/op)")
+    print(f"TextBuffer (build):      {build_time:8.3f} s")
+    print(f"TextBuffer + apply_to:   {buffer_time:8.3f} s  ({buffer_time / len(ops) * 1e6:10.1f} us/op)")
+
+
+if __name__ == '__main__':
+    main()
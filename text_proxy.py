@@ -0,0 +1,132 @@
+from operation import Operation
+
+
+class TextProxy:
+    """
+    Intercepts the insert, delete and replace commands of a Tk text widget and reports each edit
+    as an Operation with its exact position, so changes are known without reading the document.
+
+    The widget's Tcl command is renamed and a Python command takes its name; every call to the
+    widget, from Python, from Tk's key bindings or from its undo stack, goes through dispatch.
+    Edits that cannot be described exactly (a delete of several ranges) set the untracked flag,
+    so the owner can fall back to comparing the whole content.
+    """
+    def __init__(self, widget, on_operation):
+        """
+        Install the proxy on a text widget.
+
+        :param widget: The tkinter Text widget
+        :type widget: tkinter.Text
+        :param on_operation: Called with each Operation after the widget applied it
+        :type on_operation: Callable[[Operation], None]
+        """
+        self.widget = widget
+        self.on_operation = on_operation
+        self.untracked = False
+        self.original = widget._w + '_original'
+        self.tk = widget.tk
+        self.tk.call('rename', widget._w, self.original)
+        self.tk.createcommand(widget._w, self.dispatch)
+        # tkinter deletes the commands listed here when the widget is destroyed
+        if widget._tclCommands is None:
+            widget._tclCommands = []
+        widget._tclCommands.append(widget._w)
+
+    def call(self, *args):
+        """
+        Run a command on the original widget.
+        """
+        return self.tk.call((self.original,) + args)
+
+    def position(self, index: str):
+        """
+        Return the zero-based (line, char) of a Tk index, clamped to before the final newline.
+
+        :param index: Any Tk text index
+        :type index: str
+
+        :return: Tuple of (line, char)
+        :rtype: tuple[int, int]
+        """
+        if self.tk.getboolean(self.call('compare', index, '>', 'end-1c')):
+            index = 'end-1c'
+        line, char = str(self.call('index', index)).split('.')
+        return int(line) - 1, int(char)
+
+    def editable(self) -> bool:
+        """
+        Return whether the widget accepts edits; a disabled text widget ignores insert and delete.
+        """
+        return str(self.call('cget', '-state')) != 'disabled'
+
+    def dispatch(self, command, *args):
+        """
+        Forward a widget command to the original widget, reporting the edits it makes.
+
+        :param command: The widget subcommand, e.g. 'insert'
+        :type command: str
+        :param args: The arguments of the subcommand
+        :type args: str
+
+        :return: The result of the original command
+        """
+        if command == 'insert' and args and self.editable():
+            return self.insert(*args)
+        if command == 'delete' and args and self.editable():
+            return self.delete(*args)
+        if command == 'replace' and len(args) >= 3 and self.editable():
+            operations = self.deleted_range(args[0], args[1])
+            start = self.position(args[0])
+            result = self.call(command, *args)
+            for op in operations:
+                self.on_operation(op)
+            text = ''.join(args[2::2])
+            if text:
+                self.on_operation(Operation('insert', text, *start))
+            return result
+        return self.call(command, *args)
+
+    def insert(self, index, *args):
+        """
+        Insert text and report it; args are chars, tag list, chars, tag list and so on.
+        """
+        start = self.position(index)
+        result = self.call('insert', index, *args)
+        text = ''.join(args[0::2])
+        if text:
+            self.on_operation(Operation('insert', text, *start))
+        return result
+
+    def delete(self, index1, index2=None, *more):
+        """
+        Delete a range and report the removed text.
+        """
+        if more:
+            # Several ranges at once: leave it to the owner's full comparison
+            self.untracked = True
+            return self.call('delete', index1, index2, *more)
+
+        operations = self.deleted_range(index1, index2)
+        result = self.call('delete', *((index1,) if index2 is None else (index1, index2)))
+        for op in operations:
+            self.on_operation(op)
+        return result
+
+    def deleted_range(self, index1, index2=None):
+        """
+        Describe what deleting a range will remove, before it is removed.
+
+        :param index1: Start of the range
+        :type index1: str
+        :param index2: End of the range; one character after index1 if None
+        :type index2: str or None
+
+        :return: The delete operation, or an empty list if the range is empty
+        :rtype: list[Operation]
+        """
+        start = self.position(index1)
+        end = self.position(index2 if index2 is not None else f'{index1}+1c')
+        if end <= start:
+            return []
+        text = str(self.call('get', f'{start[0] + 1}.{start[1]}', f'{end[0] + 1}.{end[1]}'))
+        return [Operation('delete', text, *start)] if text else []
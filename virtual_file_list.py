@@ -0,0 +1,197 @@
+import customtkinter as ctk
+
+ROW_HEIGHT = 38  # pixels per file row: a 28 px button plus its vertical padding
+SCROLL_UNITS = 3  # rows moved per mouse wheel step
+
+
+class FileRow:
+    """
+    The widgets of one visible row of the file list. Rows are reused for whichever file scrolls
+    into their slot, so they look up the file they show when clicked.
+    """
+    def __init__(self, master, index: int, file_list):
+        """
+        Create the widgets of a row.
+
+        :param master: The frame holding the rows
+        :type master: ctk.CTkFrame
+        :param index: The slot of the row from the top of the viewport
+        :type index: int
+        :param file_list: The list the row belongs to
+        :type file_list: VirtualFileList
+        """
+        self.file = None
+        self.visible = True
+        self.action_btn = ctk.CTkButton(master, text="⋮", width=30,
+                                        command=lambda: self.file and file_list.on_actions(self.file))
+        self.name_label = ctk.CTkLabel(master, text="", anchor="w", width=200)
+        self.name_label.bind("<Double-Button-1>", lambda e: self.file and file_list.on_open(self.file))
+        self.owner_label = ctk.CTkLabel(master, text="", width=100)
+        self.date_label = ctk.CTkLabel(master, text="", width=150)
+        self.widgets = [self.action_btn, self.name_label, self.owner_label, self.date_label]
+
+        self.action_btn.grid(row=index, column=0, padx=5, pady=5)
+        self.name_label.grid(row=index, column=1, sticky="w")
+        self.owner_label.grid(row=index, column=2)
+        self.date_label.grid(row=index, column=3)
+        for widget in self.widgets:
+            file_list.bind_wheel(widget)
+
+    def show(self, file):
+        """
+        Display a file in this row, touching only the widgets whose text changed.
+
+        :param file: The file to display
+        :type file: File
+
+        :return: None
+        """
+        self.file = file
+        for label, text in ((self.name_label, file.filename), (self.owner_label, file.owner.username),
+                            (self.date_label, str(file.creation_date))):
+            if label.cget("text") != text:
+                label.configure(text=text)
+        if not self.visible:
+            self.visible = True
+            for widget in self.widgets:
+                widget.grid()
+
+    def hide(self):
+        """
+        Remove the row from the viewport, keeping its widgets for later reuse.
+
+        :return: None
+        """
+        self.file = None
+        self.visible = False
+        for widget in self.widgets:
+            widget.grid_remove()
+
+
+class VirtualFileList(ctk.CTkFrame):
+    """
+    Scrollable list of files that only creates widgets for the rows that fit in the viewport.
+    Scrolling, searching and sorting reconfigure those rows instead of rebuilding the list, so
+    the cost of an update depends on the height of the window and not on the number of files.
+    """
+    def __init__(self, master, on_open, on_actions, row_height=ROW_HEIGHT):
+        """
+        Initialize an empty list.
+
+        :param master: The parent widget
+        :type master: Any
+        :param on_open: Called with the file whose name was double-clicked
+        :type on_open: Callable[[File], None]
+        :param on_actions: Called with the file whose action button was pressed
+        :type on_actions: Callable[[File], None]
+        :param row_height: Height of a row in pixels
+        :type row_height: int
+        """
+        super().__init__(master)
+        self.on_open = on_open
+        self.on_actions = on_actions
+        self.row_height = row_height
+        self.files = []
+        self.first = 0  # index of the file shown in the top row
+        self.rows = []
+
+        self.body = ctk.CTkFrame(self, fg_color="transparent")
+        self.body.pack(side="left", fill="both", expand=True)
+        self.body.grid_propagate(False)  # the viewport decides how many rows exist, not the other way round
+        self.scrollbar = ctk.CTkScrollbar(self, command=self.yview)
+        self.scrollbar.pack(side="right", fill="y")
+
+        self.body.bind("<Configure>", lambda e: self.render())
+        self.bind_wheel(self.body)
+
+    def bind_wheel(self, widget):
+        """
+        Scroll the list with the mouse wheel while the pointer is over a widget.
+        """
+        widget.bind("<MouseWheel>", lambda e: self.scroll(-SCROLL_UNITS if e.delta > 0 else SCROLL_UNITS))
+        widget.bind("<Button-4>", lambda e: self.scroll(-SCROLL_UNITS))
+        widget.bind("<Button-5>", lambda e: self.scroll(SCROLL_UNITS))
+
+    def visible_count(self) -> int:
+        """
+        Return the number of rows that fit in the viewport.
+        """
+        return max(1, self.body.winfo_height() // self.row_height)
+
+    def set_files(self, files):
+        """
+        Show a new list of files, e.g. after a refresh, search or sort. The scroll position is kept.
+
+        :param files: The files in display order
+        :type files: list[File]
+
+        :return: None
+        """
+        self.files = list(files)
+        self.render()
+
+    def append(self, file):
+        """
+        Add a file at the end of the list.
+        """
+        self.files.append(file)
+        self.render()
+
+    def remove(self, file):
+        """
+        Remove a file from the list if it is shown.
+        """
+        if file in self.files:
+            self.files.remove(file)
+            self.render()
+
+    def refresh(self, file):
+        """
+        Redisplay a file whose details changed, e.g. after a rename; only its row is updated.
+        """
+        for row in self.rows:
+            if row.file is file:
+                row.show(file)
+
+    def scroll(self, rows: int):
+        """
+        Move the viewport by a number of rows.
+        """
+        self.first += rows
+        self.render()
+
+    def yview(self, *args):
+        """
+        Scrollbar command: ('moveto', fraction) or ('scroll', number, 'units' or 'pages').
+        """
+        if args[0] == "moveto":
+            self.first = round(float(args[1]) * len(self.files))
+        elif args[0] == "scroll":
+            step = self.visible_count() if args[2] == "pages" else 1
+            self.first += int(args[1]) * step
+        self.render()
+
+    def render(self):
+        """
+        Show the files of the current viewport in the row widgets, creating rows only when the
+        viewport grew, and update the scrollbar.
+
+        :return: None
+        """
+        count = self.visible_count()
+        self.first = max(0, min(self.first, len(self.files) - count))
+
+        while len(self.rows) < min(count, len(self.files)):
+            self.rows.append(FileRow(self.body, len(self.rows), self))
+
+        visible = self.files[self.first:self.first + count]
+        for row, file in zip(self.rows, visible):
+            row.show(file)
+        for row in self.rows[len(visible):]:
+            if row.visible:
+                row.hide()
+
+        if self.files:
+            self.scrollbar.set(self.first / len(self.files), (self.first + len(visible)) / len(self.files))
+        else:
+            self.scrollbar.set(0.0, 1.0)